@@ -1,10 +1,12 @@
 import cocotb
 from cocotb.clock import Clock
-from cocotb.triggers import Timer, GPITrigger, TriggerException, _wait_callback
+from cocotb.triggers import Timer, GPITrigger, TriggerException
 from cocotb.utils import get_sim_steps, get_time_from_sim_steps
 
 import os
-from random import randint
+import math
+import random
+import hashlib
 import itertools
 
 if "COCOTB_SIM" in os.environ:
@@ -13,17 +15,180 @@ else:
     simulator = None
 
 
+def derive_seed(seed, name):
+    """Return a seed for the random generator of *name* derived from a
+    common *seed*. Unlike ``hash()``, it is the same in every run.
+
+    .. doctest::
+
+        >>> derive_seed(1, "dut.clk48_device")
+        3135743966
+        >>> derive_seed(1, "dut.clk12") != derive_seed(1, "dut.clk48_device")
+        True
+    """
+    digest = hashlib.sha1("{}:{}".format(seed, name).encode()).digest()
+    return int.from_bytes(digest[:4], "little")
+
+
+class JitterModel:
+    """Base class of clock edge jitter models.
+
+    Models return offsets of consecutive clock edges from their nominal
+    positions, in simulator steps.
+    """
+    def __init__(self):
+        self.edge = 0
+
+    def batch(self, n, half_period):
+        """Return offsets of the next *n* edges."""
+        offsets = self._offsets(self.edge, n, half_period)
+        self.edge += n
+        return offsets
+
+    def _offsets(self, first, n, half_period):
+        raise NotImplementedError
+
+    def __str__(self):
+        return self.__class__.__name__
+
+
+class RandomJitter(JitterModel):
+    """Base class of random jitter models.
+
+    Each model has its own random generator, so a run can be reproduced by
+    passing the same *seed*.
+
+    Args:
+        seed (int, optional): Seed of the random generator. If ``None``,
+            ``USB_JITTER_SEED`` environment variable is used (see
+            ``UnstableClock`` for how it is shared between clocks), or a new
+            seed is drawn.
+    """
+    def __init__(self, seed=None):
+        super().__init__()
+        # Seed taken from the environment, to be derived per clock
+        self.env_seed = None
+        if seed is None:
+            seed = os.environ.get("USB_JITTER_SEED")
+            if seed is not None:
+                self.env_seed = int(seed)
+        if seed is None:
+            seed = random.randrange(2**32)
+        self.reseed(seed)
+
+    def reseed(self, seed):
+        """Restart the random generator with *seed*."""
+        self.seed = int(seed)
+        self.rng = random.Random(self.seed)
+
+    def __str__(self):
+        return "{}(seed={})".format(self.__class__.__name__, self.seed)
+
+
+class UniformJitter(RandomJitter):
+    """Offsets uniformly distributed between *neg* and *pos*.
+
+    .. doctest::
+
+        >>> a = UniformJitter(5, 3, seed=1).batch(100, 50)
+        >>> a == UniformJitter(5, 3, seed=1).batch(100, 50)
+        True
+        >>> min(a), max(a)
+        (-5, 3)
+    """
+    def __init__(self, neg, pos, seed=None):
+        super().__init__(seed)
+        self.values = range(-neg, pos + 1)
+
+    def _offsets(self, first, n, half_period):
+        return self.rng.choices(self.values, k=n)
+
+
+class GaussianJitter(RandomJitter):
+    """Normally distributed offsets with standard deviation *sigma*,
+    optionally clipped to +/- *limit*.
+
+    .. doctest::
+
+        >>> max(map(abs, GaussianJitter(4, limit=6, seed=1).batch(100, 50)))
+        6
+    """
+    def __init__(self, sigma, limit=None, seed=None):
+        super().__init__(seed)
+        self.sigma = sigma
+        self.limit = limit
+
+    def _offsets(self, first, n, half_period):
+        gauss = self.rng.gauss
+        offsets = [round(gauss(0, self.sigma)) for _ in range(n)]
+        if self.limit is not None:
+            offsets = [max(-self.limit, min(self.limit, o)) for o in offsets]
+        return offsets
+
+
+class SpreadSpectrum(JitterModel):
+    """Sinusoidal modulation of edge positions, as with spread-spectrum
+    clocking.
+
+    Args:
+        amplitude (float): Peak offset in simulator steps.
+        period (int): Modulation period in clock edges.
+        phase (float, optional): Initial phase in radians.
+
+    .. doctest::
+
+        >>> SpreadSpectrum(4, 8).batch(8, 50)
+        [0, 3, 4, 3, 0, -3, -4, -3]
+    """
+    def __init__(self, amplitude, period, phase=0.0):
+        super().__init__()
+        self.amplitude = amplitude
+        self.period = period
+        self.phase = phase
+
+    def _offsets(self, first, n, half_period):
+        w = 2 * math.pi / self.period
+        return [round(self.amplitude * math.sin(w * k + self.phase))
+                for k in range(first, first + n)]
+
+    def __str__(self):
+        return "{}(amplitude={}, period={})".format(
+            self.__class__.__name__, self.amplitude, self.period)
+
+
+class PpmOffset(JitterModel):
+    """Constant frequency offset of *ppm* parts per million.
+
+    .. doctest::
+
+        >>> PpmOffset(-500).batch(4, 5000)
+        [0, -2, -5, -8]
+    """
+    def __init__(self, ppm):
+        super().__init__()
+        self.ppm = ppm
+
+    def _offsets(self, first, n, half_period):
+        step = half_period * self.ppm * 1e-6
+        return [round(k * step) for k in range(first, first + n)]
+
+    def __str__(self):
+        return "{}({:+g} ppm)".format(self.__class__.__name__, self.ppm)
+
+
 class UnstableTrigger(GPITrigger):
     """A trigger with uncertainty within defined range."""
-    def __init__(self, time_ps, delta_neg, delta_pos, units=None):
+    def __init__(self, time_ps, delta_neg, delta_pos, units=None, rng=None):
         GPITrigger.__init__(self)
         self.sim_steps = get_sim_steps(time_ps, units)
         self.delta_neg = delta_neg
         self.delta_pos = delta_pos
+        self.rng = random if rng is None else rng
 
     def prime(self, callback):
         """Register for a timed callback."""
-        steps = self.sim_steps + randint(-self.delta_neg, self.delta_pos)
+        steps = self.sim_steps + self.rng.randint(-self.delta_neg,
+                                                  self.delta_pos)
         if self.cbhdl == 0:
             self.cbhdl = simulator.register_timed_callback(
                 steps, callback, self)
@@ -56,12 +221,49 @@ class UnstableClock(Clock):
             ``'sec'``.
             When no *units* is given (``None``) the timestep is determined by
             the simulator.
+        model (JitterModel, optional): Jitter model to be used instead of
+            uniform jitter between *jitter_neg* and *jitter_pos*.
+        seed (int, optional): Seed of the default uniform jitter model.
+
+    A random model seeded from ``USB_JITTER_SEED`` gets a seed derived from
+    it and the signal path (see ``derive_seed()``), so clocks sharing the
+    environment variable do not jitter in lockstep.
     """
-    def __init__(self, signal, period, jitter_neg, jitter_pos, units=None):
+    def __init__(self, signal, period, jitter_neg=0, jitter_pos=0, units=None,
+                 model=None, seed=None):
         super().__init__(signal, period, units)
         self.jitter_neg = jitter_neg
         self.jitter_pos = jitter_pos
         self.units = units
+        if model is None:
+            model = UniformJitter(jitter_neg, jitter_pos, seed)
+        if isinstance(model, RandomJitter) and model.env_seed is not None:
+            path = getattr(signal, "_path", None)
+            model.reseed(derive_seed(model.env_seed, path))
+        self.model = model
+
+    # Number of jitter samples drawn at once
+    BATCH = 1024
+
+    def _jitter_batch(self):
+        """Return a list of jitter offsets (in simulator steps) for
+        consecutive edges."""
+        return self.model.batch(self.BATCH, self.half_period)
+
+    def _schedule(self):
+        """Generate waits between consecutive edges.
+
+        Edge *k* is placed at ``k * half_period + j[k]``, so jitter does not
+        accumulate and the wait between edges is
+        ``half_period + j[k] - j[k - 1]``.
+        """
+        half = self.half_period
+        previous = 0
+        while True:
+            for offset in self._jitter_batch():
+                # Keep the edge order for jitter larger than half a period
+                yield max(1, half + offset - previous)
+                previous = offset
 
     @cocotb.coroutine
     def start(self, cycles=None, start_high=True):
@@ -77,40 +279,24 @@ class UnstableClock(Clock):
                 a ``1`` for the first half of the period.
                 Default is ``True``.
         """
-        # We need two objects to allow their periods to overlap
-        u1 = UnstableTrigger(self.half_period, self.jitter_neg,
-                             self.jitter_pos, self.units)
-        u2 = UnstableTrigger(self.half_period, self.jitter_neg,
-                             self.jitter_pos, self.units)
-
-        t = Timer(self.half_period)
-
         if cycles is None:
-            it = itertools.count()
-        else:
-            it = range(cycles)
-
-        def strobeH(ret):
-            self.signal <= 1
-
-        def strobeL(ret):
-            self.signal <= 0
-
-        # branch outside for loop for performance
-        if start_high:
-            self.signal <= 1
-            for _ in it:
-                cocotb.fork(_wait_callback(u1, strobeL))
-                yield t
-                cocotb.fork(_wait_callback(u2, strobeH))
-                yield t
+            edges = None
         else:
-            self.signal <= 0
-            for _ in it:
-                cocotb.fork(_wait_callback(u1, strobeH))
-                yield t
-                cocotb.fork(_wait_callback(u2, strobeL))
-                yield t
+            edges = 2 * cycles
+
+        # Log the model to allow reproducing the run
+        self.log.info("Clock jitter: {}".format(self.model))
+        # Waits only take a few distinct values, reuse their triggers
+        timers = {}
+        value = int(bool(start_high))
+        self.signal <= value
+        for steps in itertools.islice(self._schedule(), edges):
+            t = timers.get(steps)
+            if t is None:
+                t = timers[steps] = Timer(steps)
+            yield t
+            value ^= 1
+            self.signal <= value
 
     def __str__(self):
         """
@@ -121,6 +307,76 @@ class UnstableClock(Clock):
         return self.__class__.__name__ + "(%3.1f MHz)" % self.frequency
 
 
+class DriftClock(Clock):
+    """A 50:50 duty cycle clock driver with a constant frequency offset.
+
+    The offset half period is not a whole number of simulator steps, so the
+    fractional part is accumulated and a half period is extended by one step
+    whenever the accumulated error reaches a full step. Only two ``Timer``
+    objects are used.
+
+    Args:
+        signal: The clock pin/signal to be driven.
+        period (int): The nominal clock period. Must convert to an even
+            number of timesteps.
+        ppm (float): Period offset in parts per million, positive values
+            make the clock slower.
+        units (str, optional): Units of *period*, as in ``Clock``.
+
+    .. doctest::
+
+        >>> c = DriftClock(None, 20000, 520)
+        >>> waits = list(itertools.islice(c._schedule(), 10000))
+        >>> sorted(set(waits)), sum(waits)
+        ([10005, 10006], 100052000)
+    """
+    def __init__(self, signal, period, ppm, units=None):
+        super().__init__(signal, period, units)
+        self.ppm = ppm
+        half = self.half_period * (1 + ppm * 1e-6)
+        self.base = int(math.floor(half))
+        self.fraction = half - self.base
+
+    def _schedule(self):
+        """Generate waits between consecutive edges."""
+        base = self.base
+        longer = base + 1
+        fraction = self.fraction
+        phase = 0.0
+        while True:
+            phase += fraction
+            if phase >= 1:
+                phase -= 1
+                yield longer
+            else:
+                yield base
+
+    @cocotb.coroutine
+    def start(self, cycles=None, start_high=True):
+        """Clocking coroutine. Start driving your clock by forking a
+        call to this.
+
+        Args:
+            cycles (int, optional): Cycle the clock *cycles* number of times,
+                or if ``None`` then cycle the clock forever.
+            start_high (bool, optional): Whether to start the clock with
+                a ``1`` for the first half of the period.
+        """
+        edges = None if cycles is None else 2 * cycles
+        short = Timer(self.base)
+        longer = Timer(self.base + 1)
+        value = int(bool(start_high))
+        self.signal <= value
+        for steps in itertools.islice(self._schedule(), edges):
+            yield short if steps == self.base else longer
+            value ^= 1
+            self.signal <= value
+
+    def __str__(self):
+        return self.__class__.__name__ + "(%3.1f MHz, %+g ppm)" % (
+            self.frequency, self.ppm)
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
@@ -0,0 +1,229 @@
+import cocotb
+from cocotb.triggers import Timer, First, Join
+from cocotb.result import TestFailure, ReturnValue
+from cocotb.utils import (get_sim_time, get_sim_steps,
+                          get_time_from_sim_steps)
+
+
+def _joining(task):
+    """Return the coroutine *task* is waiting to finish, if any.
+
+    cocotb has no public way to find it, so this reads the scheduler state
+    of cocotb 1.3 (pinned in ``setup.py``). It is only used on abort, to
+    unwind coroutines that may still be driving the bus.
+    """
+    trigger = cocotb.scheduler._coro2trigger.get(task)
+    if isinstance(trigger, Join):
+        return trigger._coroutine
+    return None
+
+
+class Deadline:
+    """Single time limit of ``DeadlineManager``.
+
+    Args:
+        name (str): Name used in failure messages.
+        expiry (int): Simulation time (in simulator steps) of the deadline.
+        parent (Deadline, optional): Enclosing deadline.
+    """
+    def __init__(self, name, expiry, parent=None):
+        self.name = name
+        self.expiry = expiry
+        self.parent = parent
+        self.children = []
+        # Coroutine bounded by the deadline and the one enforcing it, if
+        # started with run()
+        self.task = None
+        self.runner = None
+        # Timer coroutine of a deadline registered with open()
+        self.watchdog = None
+        # Deadline that passed, once coroutines bounded by this one were
+        # aborted
+        self.expired_by = None
+
+    def chain(self):
+        """Yield this deadline followed by the enclosing ones."""
+        deadline = self
+        while deadline is not None:
+            yield deadline
+            deadline = deadline.parent
+
+    def earliest(self):
+        """Return the deadline of the chain that expires first."""
+        return min(self.chain(), key=lambda d: d.expiry)
+
+    def __str__(self):
+        return "Deadline({})".format(self.name)
+
+
+class DeadlineManager:
+    """Keeps nested time limits of transfers.
+
+    A deadline registered with ``open()`` bounds the coroutines started
+    with ``run()`` under it, so a packet deadline never extends past the
+    data stage or request it belongs to. The enclosing deadline is passed
+    explicitly as *parent*, so coroutines forked to run concurrently are
+    bounded the same way as the ones they are forked from.
+
+    Coroutines are aborted as soon as a deadline enclosing them passes,
+    instead of when a retry loop next checks the time. All coroutines
+    started under the expired deadline are killed, including the ones they
+    are waiting for, and their ``finally`` blocks are run (i.e. to release
+    locks). The ``run()`` directly under the expired deadline raises
+    ``TestFailure``.
+
+    Example::
+
+        request = deadlines.open(5e6, "IN request")
+        try:
+            yield deadlines.run(data_stage(deadline=request), 5e5,
+                                "data stage", parent=request)
+        finally:
+            deadlines.close(request)
+
+    Args:
+        on_abort (callable, optional): Called with the expired deadline
+            after the coroutines bounded by it are aborted.
+    """
+    def __init__(self, on_abort=None):
+        self.on_abort = on_abort
+
+    def _new(self, timeout, name, units, parent):
+        if parent is not None and parent.expired_by is not None:
+            raise TestFailure("{} not started, deadline of {} has already "
+                              "passed".format(name, parent.expired_by.name))
+        if timeout is None:
+            expiry = float('inf')
+        else:
+            expiry = get_sim_time() + get_sim_steps(timeout, units)
+        deadline = Deadline(name, expiry, parent)
+        if parent is not None:
+            parent.children.append(deadline)
+        return deadline
+
+    def open(self, timeout, name, units="us", parent=None):
+        """Register a deadline *timeout* from now, enforced until it is
+        closed.
+
+        Args:
+            timeout (float): Time limit, ``None`` for none.
+            name (str): Name used in failure messages.
+            units (str, optional): Units of *timeout*.
+            parent (Deadline, optional): Enclosing deadline.
+
+        Returns:
+            Deadline: Object to be passed to ``close()``, and as *parent* of
+            nested deadlines.
+        """
+        deadline = self._new(timeout, name, units, parent)
+        if deadline.expiry != float('inf'):
+            deadline.watchdog = cocotb.fork(self._watch(deadline))
+        return deadline
+
+    @cocotb.coroutine
+    def _watch(self, deadline):
+        yield Timer(deadline.expiry - get_sim_time())
+        deadline.watchdog = None
+        self._abort(deadline)
+
+    def close(self, deadline):
+        """Stop enforcing a deadline and forget the coroutines it bounds."""
+        if deadline.watchdog is not None:
+            deadline.watchdog.kill()
+            deadline.watchdog = None
+        parent = deadline.parent
+        if parent is not None and deadline in parent.children:
+            parent.children.remove(deadline)
+        deadline.task = None
+        deadline.runner = None
+
+    def remaining(self, deadline, units="us"):
+        """Return time left until *deadline* or an enclosing one passes."""
+        earliest = deadline.earliest()
+        if earliest.expiry == float('inf'):
+            return float('inf')
+        return get_time_from_sim_steps(earliest.expiry - get_sim_time(),
+                                       units)
+
+    def run(self, coro, timeout=None, name=None, units="us", parent=None):
+        """Run *coro*, aborting it when its own or an enclosing deadline
+        passes.
+
+        Args:
+            coro: Coroutine to be run.
+            timeout (float, optional): Own time limit of this coroutine.
+                If ``None``, only enclosing deadlines apply.
+            name (str, optional): Name used in failure messages.
+            units (str, optional): Units of *timeout*.
+            parent (Deadline, optional): Enclosing deadline.
+
+        Returns:
+            Coroutine to be yielded or forked, returning the return value of
+            *coro*.
+        """
+        if name is None:
+            name = str(coro)
+        deadline = self._new(timeout, name, units, parent)
+        deadline.task = coro
+        deadline.runner = self._run(coro, deadline)
+        return deadline.runner
+
+    @cocotb.coroutine
+    def _run(self, coro, deadline):
+        try:
+            if deadline.expiry == float('inf'):
+                # Enclosing deadlines abort coro themselves
+                result = yield coro
+            else:
+                cocotb.fork(coro)
+                timer = Timer(deadline.expiry - get_sim_time())
+                result = yield First(coro.join(), timer)
+                if result is timer and deadline.expired_by is None:
+                    self._abort(deadline)
+            if deadline.expired_by is not None:
+                raise TestFailure("{} did not finish in time, deadline of {} "
+                                  "passed at {:.0f} us"
+                                  .format(deadline.name,
+                                          deadline.expired_by.name,
+                                          get_sim_time("us")))
+            raise ReturnValue(result)
+        finally:
+            self.close(deadline)
+
+    def _abort(self, deadline):
+        """Kill every coroutine bounded by *deadline*."""
+        nested = []
+        pending = [deadline]
+        while pending:
+            node = pending.pop(0)
+            nested.append(node)
+            pending.extend(node.children)
+        tasks = []
+        for node in nested:
+            node.expired_by = deadline
+            heads = [node.task]
+            # Runners report the failure: the one of the expired deadline,
+            # and the ones opened deadlines are waiting for. Others would
+            # report to coroutines killed here.
+            if node is not deadline and not (node.parent is deadline and
+                                             deadline.task is None):
+                heads.insert(0, node.runner)
+            for task in heads:
+                # Follow the coroutines each one is waiting for
+                while task is not None and task not in tasks:
+                    tasks.append(task)
+                    task = _joining(task)
+        # Outer coroutines first, so none of them resumes on a killed one
+        for task in tasks:
+            task.kill()
+        # Unwind innermost coroutines first, running their finally blocks
+        for task in reversed(tasks):
+            task.close()
+        for node in nested:
+            if node is not deadline:
+                self.close(node)
+        if deadline.watchdog is not None:
+            deadline.watchdog.kill()
+            deadline.watchdog = None
+        if self.on_abort is not None:
+            self.on_abort(deadline)
@@ -1,8 +1,70 @@
+from functools import wraps
 from struct import pack
 
 
+def cached_bytes(method):
+    """Memoise ``__bytes__`` of a descriptor until one of its attributes is
+    assigned."""
+    @wraps(method)
+    def __bytes__(self):
+        cached = getattr(self, "_bytes", None)
+        if cached is None:
+            cached = method(self)
+            object.__setattr__(self, "_bytes", cached)
+        return cached
+    return __bytes__
+
+
+class DescriptorData(list):
+    """Read-only list of descriptor bytes, as returned by
+    ``Descriptor.get()``. Use ``list()`` to get a modifiable copy.
+
+    .. doctest::
+
+        >>> d = DescriptorData(b'\\x04\\x03')
+        >>> d
+        [4, 3]
+        >>> d[0] = 1
+        Traceback (most recent call last):
+        ...
+        TypeError: descriptor data is read-only
+    """
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("descriptor data is read-only")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = _readonly
+    sort = reverse = _readonly
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+
 class Descriptor:
-    """Base class for storing common descriptor elements."""
+    """Base class for storing common descriptor elements.
+
+    Serialized contents may be cached (see ``cached_bytes``), so assigning
+    any attribute drops the cache. Lists (of subdescriptors, LangIds etc.)
+    are stored as tuples, as changing them in place would not. Subclasses
+    declare their fields in ``__slots__``.
+
+    .. doctest::
+
+        >>> s = StringDescriptorZero(wLangIdList=[0x0409])
+        >>> bytes(s)
+        b'\\x04\\x03\\t\\x04'
+        >>> s.wLangId.append(0x0804)
+        Traceback (most recent call last):
+        ...
+        AttributeError: 'tuple' object has no attribute 'append'
+        >>> s.wLangId += (0x0804,)
+        >>> s.bLength = 6
+        >>> bytes(s)
+        b'\\x06\\x03\\t\\x04\\x04\\x08'
+    """
+
+    __slots__ = ("_bytes", "_data")
+
     class LangId:
         UNSPECIFIED = 0x0000
         ENG = 0x0409
@@ -25,14 +87,46 @@ class Descriptor:
         CLASS_SPECIFIC_INTERFACE = 0x24
         CLASS_SPECIFIC_ENDPOINT = 0x25
 
+    def __setattr__(self, name, value):
+        if isinstance(value, list):
+            value = tuple(value)
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, "_bytes", None)
+
+    def _join(self, children):
+        """Return descriptor header followed by *children* descriptors.
+
+        The result is reused as long as no attribute is assigned and every
+        child returns the same (cached) bytes object as before, so changes
+        to children are picked up too.
+        """
+        parts = [bytes(c) for c in children]
+        cached = getattr(self, "_bytes", None)
+        if (cached is not None and len(cached[1]) == len(parts)
+                and all(a is b for a, b in zip(cached[1], parts))):
+            return cached[0]
+        result = b''.join([self._header()] + parts)
+        object.__setattr__(self, "_bytes", (result, parts))
+        return result
+
     def get(self):
-        """Return descriptor contents as a list of bytes."""
-        return list(bytes(self))
+        """Return descriptor contents as a read-only list of bytes."""
+        data = bytes(self)
+        cached = getattr(self, "_data", None)
+        if cached is None or cached[0] is not data:
+            cached = (data, DescriptorData(data))
+            object.__setattr__(self, "_data", cached)
+        return cached[1]
 
 
 class DeviceDescriptor(Descriptor):
     """Class representing USB device descriptor."""
 
+    __slots__ = ("bLength", "bDescriptorType", "bcdUSB", "bDeviceClass",
+                 "bDeviceSubClass", "bDeviceProtocol", "bMaxPacketSize0",
+                 "idVendor", "idProduct", "bcdDevice", "iManufacturer",
+                 "iProduct", "iSerialNumber", "bNumConfigurations")
+
     FORMAT = "<BBH4B3H4B"
 
     def __init__(self,
@@ -65,6 +159,7 @@ class DeviceDescriptor(Descriptor):
         self.iSerialNumber = iSerialNumber
         self.bNumConfigurations = bNumConfigurations
 
+    @cached_bytes
     def __bytes__(self):
         """
         >>> d = DeviceDescriptor(
@@ -104,6 +199,9 @@ class DeviceDescriptor(Descriptor):
 class EndpointDescriptor(Descriptor):
     """Class representing standard USB endpoint descriptor."""
 
+    __slots__ = ("bLength", "bEndpointAddress", "bmAttributes",
+                 "wMaxPacketSize", "bInterval", "bDescriptorType")
+
     FORMAT = "<4BHB"
 
     class Direction:
@@ -142,6 +240,7 @@ class EndpointDescriptor(Descriptor):
         self.bInterval = bInterval
         self.bDescriptorType = bDescriptorType
 
+    @cached_bytes
     def __bytes__(self):
         """
         >>> e = EndpointDescriptor(
@@ -167,6 +266,11 @@ class EndpointDescriptor(Descriptor):
 class InterfaceDescriptor(Descriptor):
     """Class representing standard USB interface descriptor."""
 
+    __slots__ = ("bLength", "bInterfaceNumber", "bAlternateSetting",
+                 "bNumEndpoints", "bInterfaceClass", "bInterfaceSubclass",
+                 "bInterfaceProtocol", "iInterface", "bDescriptorType",
+                 "subdescriptors")
+
     FORMAT = "<BB7B"
 
     def __init__(self,
@@ -218,8 +322,14 @@ class InterfaceDescriptor(Descriptor):
         b'\\t\\x04\\x00\\x00\\x00\\xff\\x01\\xff\\x00\\x07\\x05\\x82\\x01\\x00\\x01\\x01'
         >>> i.get()
         [9, 4, 0, 0, 0, 255, 1, 255, 0, 7, 5, 130, 1, 0, 1, 1]
+        >>> e.bInterval = 2
+        >>> i.get()
+        [9, 4, 0, 0, 0, 255, 1, 255, 0, 7, 5, 130, 1, 0, 1, 2]
         """
-        desc = pack(self.FORMAT,
+        return self._join(self.subdescriptors)
+
+    def _header(self):
+        return pack(self.FORMAT,
                     self.bLength,
                     self.bDescriptorType,
                     self.bInterfaceNumber,
@@ -229,8 +339,6 @@ class InterfaceDescriptor(Descriptor):
                     self.bInterfaceSubclass,
                     self.bInterfaceProtocol,
                     self.iInterface)
-        subdesc = b''.join([bytes(e) for e in self.subdescriptors])
-        return b''.join([desc, subdesc])
 
 
 class ConfigDescriptor(Descriptor):
@@ -240,6 +348,10 @@ class ConfigDescriptor(Descriptor):
     identical contents.
     """
 
+    __slots__ = ("bLength", "wTotalLength", "bNumInterfaces",
+                 "bConfigurationValue", "iConfiguration", "bmAttributes",
+                 "bMaxPower", "bDescriptorType", "interfaces")
+
     FORMAT = "<BBH5B"
 
     class Attributes():
@@ -305,8 +417,20 @@ class ConfigDescriptor(Descriptor):
         b'\\t\\x02S\\x00\\x01\\x01\\x00@\\x00\\t\\x04\\x00\\x00\\x00\\xff\\x01\\xff\\x00\\x07\\x05\\x82\\x01\\x00\\x01\\x01'
         >>> c.get()
         [9, 2, 83, 0, 1, 1, 0, 64, 0, 9, 4, 0, 0, 0, 255, 1, 255, 0, 7, 5, 130, 1, 0, 1, 1]
+        >>> bytes(c) is bytes(c)
+        True
+        >>> c.interfaces.append(i)
+        Traceback (most recent call last):
+        ...
+        AttributeError: 'tuple' object has no attribute 'append'
+        >>> i.subdescriptors += (e,)
+        >>> len(c.get())
+        32
         """ # noqa
-        desc = pack(self.FORMAT,
+        return self._join(self.interfaces)
+
+    def _header(self):
+        return pack(self.FORMAT,
                     self.bLength,
                     self.bDescriptorType,
                     self.wTotalLength,
@@ -315,8 +439,6 @@ class ConfigDescriptor(Descriptor):
                     self.iConfiguration,
                     self.bmAttributes,
                     self.bMaxPower)
-        subdesc = b''.join([bytes(i) for i in self.interfaces])
-        return b''.join([desc, subdesc])
 
 
 class StringDescriptorZero(Descriptor):
@@ -325,6 +447,9 @@ class StringDescriptorZero(Descriptor):
      This one is different than other string descriptors in that it contains
      an array of supported LanguageIds instead of an actual string.
     """
+
+    __slots__ = ("wLangId", "bLength", "bDescriptorType")
+
     def __init__(self,
                  wLangIdList,
                  bLength=None,
@@ -336,6 +461,7 @@ class StringDescriptorZero(Descriptor):
             self.bLength = bLength
         self.bDescriptorType = bDescriptorType
 
+    @cached_bytes
     def __bytes__(self):
         """
         >>> s0 = StringDescriptorZero(wLangIdList=[0x0409])
@@ -359,6 +485,9 @@ class StringDescriptorZero(Descriptor):
 
 class StringDescriptor(Descriptor):
     """Class representing standard USB string descriptor."""
+
+    __slots__ = ("bString", "bLength", "bDescriptorType")
+
     def __init__(self,
                  bString,
                  bLength=None,
@@ -370,6 +499,7 @@ class StringDescriptor(Descriptor):
             self.bLength = bLength
         self.bDescriptorType = bDescriptorType
 
+    @cached_bytes
     def __bytes__(self):
         """
         >>> s1 = StringDescriptor("Product name")
@@ -388,6 +518,10 @@ class StringDescriptor(Descriptor):
 class DeviceQualifierDescriptor(Descriptor):
     """Class representing standard USB device qualifier descriptor."""
 
+    __slots__ = ("bcdUSB", "bDeviceClass", "bDeviceSubClass",
+                 "bDeviceProtocol", "bMaxPacketSize0",
+                 "bNumConfigurations", "bLength", "bDescriptorType")
+
     FORMAT = "<BBH6B"
 
     def __init__(self,
@@ -408,6 +542,7 @@ class DeviceQualifierDescriptor(Descriptor):
         self.bLength = bLength
         self.bDescriptorType = bDescriptorType
 
+    @cached_bytes
     def __bytes__(self):
         """
         >>> d = DeviceQualifierDescriptor(
@@ -22,7 +22,8 @@
 
 import struct
 
-from cocotb_usb.descriptors import Descriptor, USBDeviceRequest
+from cocotb_usb.descriptors import (Descriptor, USBDeviceRequest,
+                                    cached_bytes)
 from cocotb_usb.utils import getVal
 
 """
@@ -39,6 +40,8 @@ This PDF is a good reference:
 class CDC(Descriptor):
     """Base class for storing common CDC definitions."""
 
+    __slots__ = ()
+
     class Type:
         DEVICE = 0x02
         COMM = 0x02
@@ -84,6 +87,9 @@ class CDC(Descriptor):
 
 class Header(CDC):
     """Descriptor representing start of CDC class-specific section."""
+
+    __slots__ = ("bLength", "bDescriptorType", "bDescriptorSubtype",
+                 "bcdCDC")
     FORMAT = "<BBB" + "H"
 
     def __init__(self,
@@ -100,6 +106,7 @@ class Header(CDC):
     def notes(self):
         return [str(self)]
 
+    @cached_bytes
     def __bytes__(self):
         """
         >>> h = Header(bcdCDC=0x0110)
@@ -119,6 +126,9 @@ class CallManagement(CDC):
     """Describes call processing for the Communication interface.
     See section 5.2.3.2  of CDC specification for details.
     """
+
+    __slots__ = ("bLength", "bDescriptorType", "bDescriptorSubtype",
+                 "bmCapabilities", "bDataInterface")
     FORMAT = "<BBB" + "BB"
 
     def __init__(self,
@@ -137,6 +147,7 @@ class CallManagement(CDC):
     def notes(self):
         return [str(self)]
 
+    @cached_bytes
     def __bytes__(self):
         """
         >>> cm = CallManagement(
@@ -159,6 +170,9 @@ class AbstractControlManagement(CDC):
     """Describes commands supported by the ACM subclass.
     See section 5.2.3.3  of CDC specification for details.
     """
+
+    __slots__ = ("bLength", "bDescriptorType", "bDescriptorSubtype",
+                 "bmCapabilities")
     FORMAT = "<BBB" + "B"
 
     def __init__(self,
@@ -175,6 +189,7 @@ class AbstractControlManagement(CDC):
     def notes(self):
         return [str(self)]
 
+    @cached_bytes
     def __bytes__(self):
         """
         >>> acm = AbstractControlManagement(bmCapabilities=6)
@@ -194,6 +209,9 @@ class DirectLineManagement(CDC):
     """Describes commands supported by the DLCM subclass.
     See section 5.2.3.4  of CDC specification for details.
     """
+
+    __slots__ = ("bLength", "bDescriptorType", "bDescriptorSubtype",
+                 "bmCapabilities")
     FORMAT = "<BBB" + "B"
 
     def __init__(self,
@@ -210,6 +228,7 @@ class DirectLineManagement(CDC):
     def notes(self):
         return [str(self)]
 
+    @cached_bytes
     def __bytes__(self):
         """
         >>> dlm = DirectLineManagement(bmCapabilities=1)
@@ -230,6 +249,9 @@ class Union(CDC):
     a functional unit.
     See section 5.2.3.8  of CDC specification for details.
     """
+
+    __slots__ = ("bDescriptorType", "bDescriptorSubtype",
+                 "bMasterInterface", "bSlaveInterface_list")
     FIXED_FORMAT = "<BBB" + "B"     # not including bSlaveInterface_list
     FIXED_BLENGTH = struct.calcsize(FIXED_FORMAT)
 
@@ -252,6 +274,7 @@ class Union(CDC):
     def notes(self):
         return [str(self)]
 
+    @cached_bytes
     def __bytes__(self):
         """
         >>> u = Union(
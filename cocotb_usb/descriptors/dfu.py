@@ -1,5 +1,6 @@
 from struct import pack
-from cocotb_usb.descriptors import Descriptor, USBDeviceRequest
+from cocotb_usb.descriptors import (Descriptor, USBDeviceRequest,
+                                    cached_bytes)
 from cocotb_usb.utils import getVal
 
 DFU_CLASS_CODE = 0xFE       # Application specific class code
@@ -31,6 +32,9 @@ class DfuAttributes:
 class DfuFunctionalDescriptor(Descriptor):
     """Class for storing functional descriptor of DFU."""
 
+    __slots__ = ("bmAttributes", "wDetachTimeout", "wTransferSize",
+                 "bcdDFUVersion", "bLength", "bDescriptorType")
+
     TYPE = 0x21
     FORMAT = "<3B3H"
 
@@ -49,6 +53,7 @@ class DfuFunctionalDescriptor(Descriptor):
         self.bLength = bLength
         self.bDescriptorType = bDescriptorType
 
+    @cached_bytes
     def __bytes__(self):
         """
         >>> d = DfuFunctionalDescriptor(
@@ -82,6 +87,110 @@ class DfuRequest(USBDeviceRequest):
         DFU_ABORT = 6
 
 
+class DfuState:
+    """Device states reported in ``bState`` of DFU_GETSTATUS response."""
+    APP_IDLE = 0
+    APP_DETACH = 1
+    DFU_IDLE = 2
+    DFU_DNLOAD_SYNC = 3
+    DFU_DNBUSY = 4
+    DFU_DNLOAD_IDLE = 5
+    DFU_MANIFEST_SYNC = 6
+    DFU_MANIFEST = 7
+    DFU_MANIFEST_WAIT_RESET = 8
+    DFU_UPLOAD_IDLE = 9
+    DFU_ERROR = 10
+
+
+class DfuStatus:
+    """Values of ``bStatus`` field of DFU_GETSTATUS response."""
+    OK = 0x00
+    ERR_TARGET = 0x01
+    ERR_FILE = 0x02
+    ERR_WRITE = 0x03
+    ERR_ERASE = 0x04
+    ERR_CHECK_ERASED = 0x05
+    ERR_PROG = 0x06
+    ERR_VERIFY = 0x07
+    ERR_ADDRESS = 0x08
+    ERR_NOTDONE = 0x09
+    ERR_FIRMWARE = 0x0A
+    ERR_VENDOR = 0x0B
+    ERR_USBR = 0x0C
+    ERR_POR = 0x0D
+    ERR_UNKNOWN = 0x0E
+    ERR_STALLEDPKT = 0x0F
+
+
+Type = USBDeviceRequest.Type  # limit verbosity
+
+
+def dnloadRequest(interface, block, length):
+    """Return a byte list corresponding to a DFU_DNLOAD request.
+
+    Args:
+        interface (int): DFU interface number.
+        block (int): Block number, wraps around at 0xFFFF.
+        length (int): Length of the block, 0 to start manifestation.
+
+    .. doctest::
+
+        >>> dnloadRequest(interface=0, block=2, length=1024)
+        [33, 1, 2, 0, 0, 0, 0, 4]
+    """
+    return USBDeviceRequest.build(
+            bmRequestType=Type.HOST_TO_DEVICE | Type.CLASS | Type.INTERFACE,
+            bRequest=DfuRequest.Type.DFU_DNLOAD,
+            wValue=block & 0xFFFF,
+            wIndex=interface,
+            wLength=length,
+            )
+
+
+def getStatusRequest(interface):
+    """Return a byte list corresponding to a DFU_GETSTATUS request.
+
+    Args:
+        interface (int): DFU interface number.
+
+    .. doctest::
+
+        >>> getStatusRequest(interface=0)
+        [161, 3, 0, 0, 0, 0, 6, 0]
+    """
+    return USBDeviceRequest.build(
+            bmRequestType=Type.DEVICE_TO_HOST | Type.CLASS | Type.INTERFACE,
+            bRequest=DfuRequest.Type.DFU_GETSTATUS,
+            wValue=0,
+            wIndex=interface,
+            wLength=6,
+            )
+
+
+def statusResponse(bState, bwPollTimeout=0, bStatus=DfuStatus.OK,
+                   iString=0):
+    """Return the 6 bytes of a DFU_GETSTATUS response.
+
+    Args:
+        bState (int): Device state, see ``DfuState``.
+        bwPollTimeout (int, optional): Time (in ms) the host should wait
+            before the next DFU_GETSTATUS request.
+        bStatus (int, optional): Status of the previous request.
+        iString (int, optional): Index of status description string.
+
+    .. doctest::
+
+        >>> statusResponse(DfuState.DFU_DNBUSY, bwPollTimeout=300)
+        [0, 44, 1, 0, 4, 0]
+    """
+    return [bStatus,
+            bwPollTimeout & 0xFF,
+            (bwPollTimeout >> 8) & 0xFF,
+            (bwPollTimeout >> 16) & 0xFF,
+            bState,
+            iString]
+
+
 def parseDfuFunctional(f):
     """Parser function to read values of supported DFU descriptors for
     the device from config file.
@@ -1,4 +1,10 @@
+import glob
+import hashlib
 import json
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from struct import pack
 from cocotb_usb.descriptors import (Descriptor, EndpointDescriptor,
                                     InterfaceDescriptor,
                                     ConfigDescriptor, DeviceDescriptor,
@@ -6,7 +12,10 @@ from cocotb_usb.descriptors import (Descriptor, EndpointDescriptor,
                                     DeviceQualifierDescriptor)
 from cocotb_usb.descriptors.dfu import DFU_CLASS_CODE, dfuParsers
 from cocotb_usb.descriptors.cdc import CDC, cdcParsers
-from cocotb_usb.utils import getVal
+from cocotb_usb.usb.pid import PID
+from cocotb_usb.usb.packet import data_packet, wrap_packet, crc16
+from cocotb_usb.usb.pp_packet import pp_packet
+from cocotb_usb.utils import getVal, grouper_tofit
 
 
 def isStandard(descriptorType):
@@ -388,27 +397,515 @@ def parse(field, customParsers=None):
         return None
 
 
+ExpectedPacket = namedtuple("ExpectedPacket", ["pid", "data", "crc",
+                                               "waveform", "expected"])
+ExpectedPacket.__doc__ = """Data packet expected from the device, prepared
+    once for comparison with received packets.
+
+    Args:
+        pid: Either ``PID.DATA0`` or ``PID.DATA1``.
+        data (bytes): Packet payload.
+        crc (list): CRC16 of the payload.
+        waveform (str): Line states of the wrapped packet.
+        expected (str): Pretty-printed *waveform*, as compared by the host.
+"""
+
+
+def expected_packets(data, max_packet_size, pid=PID.DATA1):
+    """Split expected IN data into packets with toggling PIDs.
+
+    An empty list gives a single zero-length packet.
+
+    .. doctest::
+
+        >>> p = expected_packets(bytes(range(10)), 8)
+        >>> [(x.pid.name, list(x.data)) for x in p]
+        [('DATA1', [0, 1, 2, 3, 4, 5, 6, 7]), ('DATA0', [8, 9])]
+        >>> p[1].crc
+        [57, 137]
+    """
+    packets = []
+    for chunk in grouper_tofit(max_packet_size, data) or [[]]:
+        waveform = wrap_packet(data_packet(pid, chunk))
+        packets.append(ExpectedPacket(pid, bytes(chunk), crc16(chunk),
+                                      waveform, pp_packet(waveform)))
+        pid = PID.DATA0 if pid == PID.DATA1 else PID.DATA1
+    return tuple(packets)
+
+
+class DescriptorError(ValueError):
+    """Raised when descriptor fields contradict the descriptor tree."""
+
+
+def _header_length(desc):
+    """Return length of *desc* itself, without its children."""
+    if isinstance(desc, (ConfigDescriptor, InterfaceDescriptor)):
+        return len(desc._header())
+    return len(bytes(desc))
+
+
+class ConfigIndex:
+    """Index of interfaces and endpoints of a configuration descriptor.
+
+    Attributes:
+        interfaces (dict): Interface descriptors, keyed by
+            ``(bInterfaceNumber, bAlternateSetting)``.
+        endpoints (dict): Endpoint descriptors of every interface, keyed
+            like *interfaces*, then by ``bEndpointAddress``.
+
+    .. doctest::
+
+        >>> e = EndpointDescriptor(7, 0x82, 0x02, 64, 0)
+        >>> i = InterfaceDescriptor(9, 0, 0, 1, 0xFF, 0, 0, 0,
+        ...                         subdescriptors=[e])
+        >>> c = ConfigDescriptor(9, 25, 1, 1, 0, 0x80, 50, interfaces=[i])
+        >>> index = ConfigIndex(c)
+        >>> index.derived()
+        {'wTotalLength': 25, 'bNumInterfaces': 1}
+        >>> [hex(e.bEndpointAddress) for _, e in index.find_endpoints(
+        ...     EndpointDescriptor.TransferType.BULK,
+        ...     EndpointDescriptor.Direction.IN)]
+        ['0x82']
+        >>> c.wTotalLength = 32
+        >>> ConfigIndex(c).errors()
+        ['Configuration 1: wTotalLength is 32, descriptors add up to 25']
+    """
+    def __init__(self, config):
+        self.config = config
+        self.interfaces = {}
+        self.endpoints = {}
+        for intf in config.interfaces:
+            key = (intf.bInterfaceNumber, intf.bAlternateSetting)
+            self.interfaces[key] = intf
+            self.endpoints[key] = {}
+            for desc in intf.subdescriptors:
+                if isinstance(desc, EndpointDescriptor):
+                    self.endpoints[key].setdefault(desc.bEndpointAddress,
+                                                   []).append(desc)
+        for key, endpoints in self.endpoints.items():
+            self.endpoints[key] = {addr: eps[0]
+                                   for addr, eps in endpoints.items()}
+        self._duplicates = [
+            (key, desc.bEndpointAddress)
+            for key, intf in self.interfaces.items()
+            for desc in intf.subdescriptors
+            if isinstance(desc, EndpointDescriptor)
+            and self.endpoints[key][desc.bEndpointAddress] is not desc]
+
+    def derived(self):
+        """Return configuration fields derived from the descriptor tree."""
+        return {
+            "wTotalLength": len(bytes(self.config)),
+            "bNumInterfaces": len({num for num, _ in self.interfaces}),
+        }
+
+    def find_endpoints(self, transfer_type=None, direction=None):
+        """Return ``(interface, endpoint)`` pairs of endpoints matching
+        transfer type and direction (see ``EndpointDescriptor``)."""
+        found = []
+        for key, endpoints in self.endpoints.items():
+            for addr, ep in endpoints.items():
+                if (transfer_type is not None
+                        and ep.bmAttributes & 0x03 != transfer_type):
+                    continue
+                if direction is not None and addr >> 7 != direction:
+                    continue
+                found.append((self.interfaces[key], ep))
+        return found
+
+    def errors(self):
+        """Return a list of inconsistencies found."""
+        name = "Configuration {}".format(self.config.bConfigurationValue)
+        errors = []
+        for field, value in self.derived().items():
+            claimed = getattr(self.config, field)
+            if claimed != value:
+                errors.append("{}: {} is {}, descriptors add up to {}"
+                              .format(name, field, claimed, value))
+        for (num, alt), intf in self.interfaces.items():
+            count = sum(isinstance(d, EndpointDescriptor)
+                        for d in intf.subdescriptors)
+            if intf.bNumEndpoints != count:
+                errors.append("{}: interface {} alternate setting {} has "
+                              "bNumEndpoints {}, but {} endpoints"
+                              .format(name, num, alt, intf.bNumEndpoints,
+                                      count))
+        for (num, alt), addr in self._duplicates:
+            errors.append("{}: interface {} alternate setting {} has "
+                          "endpoint {:#04x} more than once"
+                          .format(name, num, alt, addr))
+        descs = [self.config] + list(self.interfaces.values()) + [
+            d for intf in self.interfaces.values()
+            for d in intf.subdescriptors if d is not None]
+        for desc in descs:
+            length = _header_length(desc)
+            if desc.bLength != length:
+                errors.append("{}: {} has bLength {}, but {} bytes"
+                              .format(name, desc.__class__.__name__,
+                                      desc.bLength, length))
+        return errors
+
+    def validate(self):
+        """Raise ``DescriptorError`` listing all inconsistencies."""
+        errors = self.errors()
+        if errors:
+            raise DescriptorError("\n".join(errors))
+
+
 class UsbDevice:
     """Object for storing USB descriptors information in a structured manner
 
     Args:
         config_file (path): JSON file containing descriptor values.
+        validate (bool, optional): Check that length and count fields match
+            the descriptor tree and raise ``DescriptorError`` otherwise.
     """
-    def __init__(self, config_file):
+    def __init__(self, config_file, validate=True):
+        self._load(_read_device_file(config_file), validate)
+
+    @classmethod
+    def from_json(cls, contents, validate=True):
+        """Create device from contents of a JSON description file.
+
+        Args:
+            contents (bytes): File contents.
+            validate (bool, optional): See ``UsbDevice``.
+        """
+        device = cls.__new__(cls)
+        device._load(contents, validate)
+        return device
+
+    def _load(self, contents, validate):
         self.configDescriptor = {}
         self.descriptors = []  # Other descriptors
-        with open(config_file, "r") as f:
-            data = json.load(f)
-            for item in data:
-                desc = parse(item)
-                if isinstance(desc, DeviceDescriptor):
-                    self.deviceDescriptor = desc
-                elif isinstance(desc, ConfigDescriptor):
-                    self.configDescriptor[desc.bConfigurationValue] = desc
-                elif isinstance(desc, StringDescriptorDict):
-                    self.stringDescriptor = desc
-                elif desc is not None:
-                    self.descriptors.append(desc)
+        # Serialized descriptors and the bundle built from them
+        self._bundle = None
+        for item in json.loads(contents.decode()):
+            desc = parse(item)
+            if isinstance(desc, DeviceDescriptor):
+                self.deviceDescriptor = desc
+            elif isinstance(desc, ConfigDescriptor):
+                self.configDescriptor[desc.bConfigurationValue] = desc
+            elif isinstance(desc, StringDescriptorDict):
+                self.stringDescriptor = desc
+            elif desc is not None:
+                self.descriptors.append(desc)
+        self.index = {value: ConfigIndex(config)
+                      for value, config in self.configDescriptor.items()}
+        if validate:
+            self.validate()
+
+    def validate(self):
+        """Raise ``DescriptorError`` if the descriptors are inconsistent."""
+        errors = []
+        device = getattr(self, "deviceDescriptor", None)
+        if device is None:
+            errors.append("No device descriptor")
+        elif device.bNumConfigurations != len(self.configDescriptor):
+            errors.append("bNumConfigurations is {}, but {} configurations"
+                          .format(device.bNumConfigurations,
+                                  len(self.configDescriptor)))
+        for index in self.index.values():
+            errors.extend(index.errors())
+        if errors:
+            raise DescriptorError("\n".join(errors))
+
+    @property
+    def bundle(self):
+        """``DescriptorBundle`` of this device.
+
+        Bundles are shared by devices with the same serialized descriptors,
+        so one is only built once per session. Changing a descriptor gives
+        a new bundle.
+
+        .. doctest::
+
+            >>> dev = UsbDevice.from_json(
+            ...     b'[{"name": "Device", "bLength": 18, "bDescriptorType": 1,'
+            ...     b' "bcdUSB": "0x0200", "bDeviceClass": 0,'
+            ...     b' "bDeviceSubClass": 0, "bDeviceProtocol": 0,'
+            ...     b' "bMaxPacketSize0": 64, "idVendor": "0x1209",'
+            ...     b' "idProduct": "0x5bf0", "bcdDevice": "0x0101",'
+            ...     b' "iManufacturer": 0, "iProduct": 0, "iSerial": 0,'
+            ...     b' "bNumConfigurations": 1}]', validate=False)
+            >>> dev.bundle is dev.bundle
+            True
+            >>> dev.bundle[(Descriptor.Types.DEVICE, 0, 0)][7]
+            64
+            >>> dev.deviceDescriptor.bMaxPacketSize0 = 8
+            >>> dev.bundle[(Descriptor.Types.DEVICE, 0, 0)][7]
+            8
+        """
+        items = tuple(DescriptorBundle.serialize(self))
+        if self._bundle is not None and self._bundle[0] == items:
+            return self._bundle[1]
+        key = _descriptors_key(items)
+        bundle = _bundles.get(key)
+        if bundle is None:
+            bundle = DescriptorBundle(items)
+            _bundles[key] = bundle
+        self._bundle = (items, bundle)
+        return bundle
+
+    def response(self, setup, max_packet_size=64):
+        """Return data packets expected in reply to a GET_DESCRIPTOR
+        request, see ``DescriptorBundle.response()``."""
+        return self.bundle.response(setup, max_packet_size)
+
+
+class DescriptorBundle(dict):
+    """Serialized descriptors of a device, indexed by
+    ``(type, index, langid)`` as in a GET_DESCRIPTOR request.
+
+    Configuration descriptors are indexed in the order they were described,
+    string descriptors by their index and LangId (``0`` for the list of
+    LangIds). Other descriptors are indexed in the order of their type.
+    """
+    # Bump when the layout of the bundle changes
+    VERSION = 2
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._responses = {}
+
+    @property
+    def configuration_value(self):
+        """``bConfigurationValue`` of the first configuration."""
+        return self[(Descriptor.Types.CONFIGURATION, 0, 0)][5]
+
+    @classmethod
+    def from_device(cls, device):
+        return cls(cls.serialize(device))
+
+    @staticmethod
+    def serialize(device):
+        """Yield ``(key, bytes)`` pairs of all descriptors of *device*.
+
+        Descriptors cache their serialized contents, so this is cheap for
+        a device that did not change.
+        """
+        yield (Descriptor.Types.DEVICE, 0, 0), bytes(device.deviceDescriptor)
+        for idx, config in enumerate(device.configDescriptor.values()):
+            yield (Descriptor.Types.CONFIGURATION, idx, 0), bytes(config)
+        strings = getattr(device, "stringDescriptor", {})
+        for lang_id, descriptors in strings.items():
+            if lang_id == 0:
+                yield (Descriptor.Types.STRING, 0, 0), bytes(descriptors)
+                continue
+            for idx, desc in descriptors.items():
+                yield (Descriptor.Types.STRING, idx, lang_id), bytes(desc)
+        counts = {}
+        for desc in device.descriptors:
+            data = bytes(desc)
+            dtype = data[1]
+            idx = counts.get(dtype, 0)
+            counts[dtype] = idx + 1
+            yield (dtype, idx, 0), data
+
+    def descriptor(self, dtype, index=0, lang_id=0):
+        """Return descriptor contents as a list of bytes."""
+        return list(self[(dtype, index, lang_id)])
+
+    def response(self, setup, max_packet_size=64):
+        """Return data packets expected in reply to a GET_DESCRIPTOR
+        request.
+
+        Responses are truncated to ``wLength`` of the request, split into
+        packets of *max_packet_size* and kept in a table, so repeated
+        requests reuse the packets.
+
+        Args:
+            setup: GET_DESCRIPTOR request, as list of bytes.
+            max_packet_size (int, optional): Maximum packet size of the
+                control endpoint.
+
+        Returns:
+            tuple: ``ExpectedPacket`` objects, to be passed as expected data
+            of an IN control transfer.
+        """
+        key = (bytes(setup), max_packet_size)
+        packets = self._responses.get(key)
+        if packets is None:
+            index, dtype = setup[2], setup[3]
+            lang_id = setup[4] | setup[5] << 8
+            length = setup[6] | setup[7] << 8
+            data = self[(dtype, index, lang_id)][:length]
+            packets = expected_packets(data, max_packet_size)
+            self._responses[key] = packets
+        return packets
+
+    def dumps(self):
+        """Serialize bundle to a JSON string.
+
+        .. doctest::
+
+            >>> b = DescriptorBundle({(1, 0, 0): bytes([18, 1])})
+            >>> DescriptorBundle.loads(b.dumps()) == b
+            True
+        """
+        return json.dumps({
+            "version": self.VERSION,
+            "descriptors": [[dtype, index, lang_id, data.hex()]
+                            for (dtype, index, lang_id), data
+                            in self.items()],
+        })
+
+    @classmethod
+    def loads(cls, text):
+        """Create bundle from a string returned by ``dumps()``.
+
+        Raises:
+            ValueError: Malformed bundle or a different bundle version.
+        """
+        data = json.loads(text)
+        if data.get("version") != cls.VERSION:
+            raise ValueError("Bundle version {}, expected {}".format(
+                data.get("version"), cls.VERSION))
+        return cls(((dtype, index, lang_id), bytes.fromhex(contents))
+                   for dtype, index, lang_id, contents
+                   in data["descriptors"])
+
+
+# Bundles by serialized descriptors, and by contents of compiled files
+_bundles = {}
+_compiled = {}
+
+
+def _read_device_file(config_file):
+    with open(config_file, "rb") as f:
+        return f.read()
+
+
+def _contents_key(contents):
+    digest = hashlib.sha1(contents).hexdigest()
+    return "{}-v{}".format(digest, DescriptorBundle.VERSION)
+
+
+def _bundle_key(config_file):
+    return _contents_key(_read_device_file(config_file))
+
+
+def _descriptors_key(items):
+    digest = hashlib.sha1()
+    for (dtype, index, lang_id), data in items:
+        digest.update(pack("<BBHH", dtype, index, lang_id, len(data)))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def compile_device(config_file, cache_dir=None):
+    """Return a ``DescriptorBundle`` of a device described by JSON file.
+
+    Bundles are cached by hash of the file contents, in memory and as JSON
+    files in *cache_dir* (``USB_DESCRIPTOR_CACHE`` environment variable by
+    default; no files are written if neither is set), so the device file
+    is read once and only parsed when it changes. Cache files hold plain
+    data, so a cache directory can be shared.
+
+    Args:
+        config_file (path): JSON file containing descriptor values.
+        cache_dir (path, optional): Directory for compiled bundles.
+    """
+    contents = _read_device_file(config_file)
+    key = _contents_key(contents)
+    if key in _compiled:
+        return _compiled[key]
+
+    if cache_dir is None:
+        cache_dir = os.environ.get("USB_DESCRIPTOR_CACHE")
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, key + ".json")
+        try:
+            with open(path, "r") as f:
+                _compiled[key] = DescriptorBundle.loads(f.read())
+            return _compiled[key]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    bundle = _compiled[key] = UsbDevice.from_json(contents).bundle
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first, so concurrent tests never read
+        # a partial bundle
+        tmp = "{}.{}".format(path, os.getpid())
+        with open(tmp, "w") as f:
+            f.write(bundle.dumps())
+        os.replace(tmp, path)
+    return bundle
+
+
+LoadResult = namedtuple("LoadResult", ["devices", "errors"])
+LoadResult.__doc__ = """Result of ``load_devices()``.
+
+    Args:
+        devices (dict): Loaded objects, keyed by file path.
+        errors (dict): Error messages of files which failed to load, keyed
+            by file path.
+"""
+
+
+def _load_device(config_file, bundles, cache_dir):
+    """Load one device file, returning ``(key, result, error)``"""
+    try:
+        if bundles:
+            return (_bundle_key(config_file),
+                    compile_device(config_file, cache_dir), None)
+        return None, UsbDevice(config_file), None
+    except Exception as e:
+        return None, None, "{}: {}".format(e.__class__.__name__, e)
+
+
+def load_devices(files, bundles=False, workers=None, cache_dir=None):
+    """Load many device description files in parallel.
+
+    Files are parsed (and validated) in a pool of worker processes. A file
+    that fails to load is reported in the result and does not stop the
+    others.
+
+    Args:
+        files: List of JSON files, a single file, or a directory to load
+            all ``*.json`` files from.
+        bundles (bool, optional): Return compiled ``DescriptorBundle``
+            objects (see ``compile_device()``) instead of ``UsbDevice``.
+        workers (int, optional): Number of worker processes, defaults to
+            the number of CPUs. ``1`` loads files in this process.
+        cache_dir (path, optional): Directory for compiled bundles.
+
+    Returns:
+        LoadResult: Loaded objects and errors, keyed by file path.
+
+    A single path is loaded as a list of one file:
+
+    >>> result = load_devices("missing.json")
+    >>> list(result.errors)
+    ['missing.json']
+    """
+    if isinstance(files, (str, os.PathLike)):
+        if os.path.isdir(files):
+            files = sorted(glob.glob(os.path.join(files, "*.json")))
+        else:
+            files = [files]
+    files = list(files)
+    if workers == 1 or len(files) < 2:
+        results = [_load_device(f, bundles, cache_dir) for f in files]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_load_device, files,
+                                    [bundles] * len(files),
+                                    [cache_dir] * len(files)))
+
+    devices = {}
+    errors = {}
+    for config_file, (key, result, error) in zip(files, results):
+        if error is not None:
+            errors[config_file] = error
+            continue
+        devices[config_file] = result
+        if key is not None:
+            # Bundles compiled by workers are cached here too
+            _compiled[key] = result
+    return LoadResult(devices, errors)
 
 
 if __name__ == "__main__":
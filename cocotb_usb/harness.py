@@ -12,6 +12,8 @@ def get_harness(dut, **kwargs):
     '''
     if TARGET == 'valentyusb':
         dut_csrs = environ['DUT_CSRS']  # We want a KeyError if this is unset
+        # Optional interrupt net to wait on instead of polling CSRs
+        kwargs.setdefault('irq', environ.get('DUT_IRQ'))
         harness = UsbTestValenty(dut, dut_csrs, **kwargs)
     else:  # No target matched
         harness = UsbTest(dut, **kwargs)  # base class
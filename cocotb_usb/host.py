@@ -1,24 +1,150 @@
 import inspect
+from collections import namedtuple
+
 import cocotb
 from cocotb.clock import Clock
-from cocotb.triggers import RisingEdge, Timer, ClockCycles
-from cocotb.result import TestFailure, TestError
-from cocotb.utils import get_sim_time
+from cocotb.triggers import RisingEdge, Timer, ClockCycles, Lock
+from cocotb.result import TestFailure, TestError, ReturnValue
+from cocotb.utils import get_sim_time, get_sim_steps
 
 from cocotb_usb.descriptors import (Descriptor, getDescriptorRequest,
                                     setAddressRequest, setConfigurationRequest)
 from cocotb_usb.usb.pid import PID
 from cocotb_usb.usb.endpoint import EndpointType
 from cocotb_usb.usb.packet import (wrap_packet, token_packet, data_packet,
-                                   sof_packet, handshake_packet)
+                                   sof_packet, handshake_packet, line_runs)
 from cocotb_usb.usb.pp_packet import pp_packet
 
 from cocotb_usb.utils import grouper_tofit, assertEqual
+from cocotb_usb.device import (ExpectedPacket, DescriptorBundle, UsbDevice,
+                               compile_device)
 from cocotb_usb.monitor import UsbMonitor
+from cocotb_usb.clocks import DriftClock
+from cocotb_usb.timing import get_profile, record_profile
+from cocotb_usb.progress import get_reporter
+from cocotb_usb.deadline import DeadlineManager
 
 from explainusb import Analyze
 
 
+def in_chunks(data, chunk_size):
+    """Split expected IN data into ``(payload, expected)`` pairs.
+
+    *data* is either a list of bytes, split into chunks of *chunk_size*, or
+    a sequence of ``ExpectedPacket`` objects (see ``UsbDevice.response()``)
+    which are already split.
+    """
+    if data and isinstance(data[0], ExpectedPacket):
+        return [(list(p.data), p) for p in data]
+    return [(chunk, chunk) for chunk in grouper_tofit(chunk_size, data)]
+
+
+def out_chunks(data, chunk_size):
+    """Split OUT data into packet payloads.
+
+    Buffers (``bytes``, ``bytearray``, ``memoryview``) are sliced, so a
+    memory-mapped image is only turned into a list one packet at a time.
+    Other sequences are split with ``grouper_tofit``.
+
+    .. doctest::
+
+        >>> [bytes(c) for c in out_chunks(memoryview(b"abcde"), 2)]
+        [b'ab', b'cd', b'e']
+        >>> out_chunks([1, 2, 3], 2)
+        [[1, 2], [3]]
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return [data[i:i + chunk_size]
+                for i in range(0, len(data), chunk_size)]
+    return grouper_tofit(chunk_size, data)
+
+
+EnumerationData = namedtuple("EnumerationData", ["device_length",
+                                                 "device",
+                                                 "config_length",
+                                                 "config",
+                                                 "config_header",
+                                                 "strings",
+                                                 "configuration_value"])
+EnumerationData.__doc__ = """Responses expected during enumeration.
+
+    Args:
+        device_length (int): Length of the device descriptor.
+        device (tuple): Packets of the device descriptor.
+        config_length (int): ``wTotalLength`` of the first configuration.
+        config (tuple): Packets of the whole configuration descriptor.
+        config_header (tuple): Packets of its first 9 bytes.
+        strings (list): ``(lang_id, index, packets)`` of string descriptors.
+        configuration_value (int): Value sent with SET_CONFIGURATION.
+"""
+
+
+def enumeration_data(device, max_packet_size, strings=True):
+    """Return responses a device should give during enumeration.
+
+    Args:
+        device (UsbDevice, DescriptorBundle or path): See
+            ``UsbTest.enumerate()``.
+        max_packet_size (int): Maximum packet size of the control endpoint.
+        strings (bool, optional): Include string descriptors.
+
+    Returns:
+        EnumerationData: Expected responses.
+
+    .. doctest::
+
+        >>> dev = UsbDevice.from_json(
+        ...     b'[{"name": "Device", "bLength": 18, "bDescriptorType": 1,'
+        ...     b' "bcdUSB": "0x0200", "bDeviceClass": 0,'
+        ...     b' "bDeviceSubClass": 0, "bDeviceProtocol": 0,'
+        ...     b' "bMaxPacketSize0": 64, "idVendor": "0x1209",'
+        ...     b' "idProduct": "0x5bf0", "bcdDevice": "0x0101",'
+        ...     b' "iManufacturer": 0, "iProduct": 0, "iSerial": 0,'
+        ...     b' "bNumConfigurations": 1},'
+        ...     b' {"name": "Configuration", "bLength": 9,'
+        ...     b' "bDescriptorType": 2, "wTotalLength": 9,'
+        ...     b' "bNumInterfaces": 0, "bConfigurationValue": 1,'
+        ...     b' "iConfiguration": 0, "bmAttributes": "0x80",'
+        ...     b' "bMaxPower": 50, "Interface": []}]')
+        >>> enumeration_data(dev, 64).device[0].data[7]
+        64
+        >>> dev.deviceDescriptor.bMaxPacketSize0 = 8
+        >>> dev.configDescriptor[1].bMaxPower = 100
+        >>> data = enumeration_data(dev, 64)
+        >>> data.device[0].data[7], data.config[0].data[8]
+        (8, 100)
+    """
+    if isinstance(device, DescriptorBundle):
+        bundle = device
+    elif isinstance(device, UsbDevice):
+        bundle = device.bundle
+    else:
+        bundle = compile_device(device)
+
+    def response(dtype, length, index=0,
+                 lang_id=Descriptor.LangId.UNSPECIFIED):
+        return bundle.response(getDescriptorRequest(dtype, index,
+                                                    lang_id, length),
+                               max_packet_size)
+
+    device_length = len(bundle[(Descriptor.Types.DEVICE, 0, 0)])
+    config_length = len(bundle[(Descriptor.Types.CONFIGURATION, 0, 0)])
+    string_data = []
+    if strings:
+        for dtype, idx, lang_id in bundle:
+            if dtype == Descriptor.Types.STRING:
+                string_data.append((lang_id, idx, response(
+                    Descriptor.Types.STRING, 255, idx, lang_id)))
+    return EnumerationData(
+        device_length,
+        response(Descriptor.Types.DEVICE, device_length),
+        config_length,
+        response(Descriptor.Types.CONFIGURATION, config_length),
+        response(Descriptor.Types.CONFIGURATION, 9),
+        string_data,
+        bundle.configuration_value)
+
+
 class UsbTest:
     """
     Base class for communicating with a USB test bench.
@@ -28,15 +154,36 @@ class UsbTest:
         decouple_clocks (bool, optional): Indicates whether host and device
             share clock signal. If set to False (default), you must provide
             clk48_device clock in test.
+        device_ppm (float, optional): Frequency offset of the device clock
+            (in parts per million) when clocks are not decoupled.
+        timing (str or TimingProfile, optional): Timing profile for resets
+            and recovery periods, one of ``'spec'`` (default), ``'fast'`` or
+            ``'minimal'``. Can also be set with ``USB_TIMING`` environment
+            variable.
+        heartbeat (bool or float, optional): Set to ``False`` to disable
+            periodic progress messages or to a number to change their
+            interval (in simulated us). Can also be set with
+            ``USB_HEARTBEAT`` environment variable.
     """
     # Retry interval if getting NAKs, arbitrary value - should be small enough
     # not to limit long transfers, but large enough not to pepper the traces
     # with NAKed requests
     RETRY_INTERVAL = 50  # us
+    # Delay before each IN token sent by host_recv()
+    IN_TOKEN_DELAY = 5  # us
     # Times to complete transfers (in microseconds)
     MAX_REQUEST_TIME = 5e6      # 5 seconds
+    MAX_SETUP_TIME = 5e3        # 5 ms
     MAX_PACKET_TIME = 5e4       # 50 ms
     MAX_DATA_PACKET_TIME = 5e5  # 500 ms
+    MAX_ENUMERATION_TIME = 5e6  # 5 seconds
+    # Full speed frame length (in microseconds)
+    SOF_INTERVAL = 1e3
+    # Line states of SOF packets for every frame number, shared by all
+    # instances and built on first use of the SOF keep-alive
+    _sof_frames = None
+    # Pretty-printed NAK packet, compared with every received packet
+    _nak = None
 
     def __init__(self, dut, **kwargs):
         decouple_clocks = kwargs.get('decouple_clocks', False)
@@ -45,14 +192,29 @@ class UsbTest:
         self.clock_period = 20830
         cocotb.fork(Clock(dut.clk48_host, self.clock_period, 'ps').start())
         if not decouple_clocks:
-            cocotb.fork(
-                Clock(dut.clk48_device, self.clock_period, 'ps').start())
+            device_ppm = kwargs.get('device_ppm')
+            if device_ppm:
+                device_clock = DriftClock(dut.clk48_device, self.clock_period,
+                                          device_ppm, 'ps')
+            else:
+                device_clock = Clock(dut.clk48_device, self.clock_period,
+                                     'ps')
+            cocotb.fork(device_clock.start())
 
         self.dut.usb_d_p = 0
         self.dut.usb_d_n = 0
-        # Initialize packet timeouts if someone uses low-level functions only
-        self.packet_deadline = float('inf')
-        self.request_deadline = float('inf')
+        # Time limits of transfers, enforced while the transfer is running
+        self.deadlines = DeadlineManager(on_abort=self._abort_transaction)
+        # Serializes host transactions with the background SOF generator
+        self._bus_lock = Lock("usb_host")
+        self._sof = None
+        self._sof_sleeping = False
+        self._sof_generation = 0
+        self.frame = 0
+        # Start time (in us) of the first and the latest IN token sent by
+        # the last host_recv(), they differ when the device NAKed
+        self.first_in_token = 0
+        self.last_in_token = 0
 
         self.monitor = UsbMonitor(self.dut,
                                   "usb",
@@ -65,6 +227,12 @@ class UsbTest:
         tn.buff = test_name
         self.dut.test_name = tn
 
+        self.timing = get_profile(kwargs.get('timing'))
+        self.dut._log.info("Using timing profile: {}".format(self.timing))
+        record_profile(self.timing, test_name)
+
+        self.progress = get_reporter(self.dut._log, kwargs.get('heartbeat'))
+
     @cocotb.coroutine
     def reset(self):
         """Reset DUT."""
@@ -79,9 +247,9 @@ class UsbTest:
 
     @cocotb.coroutine
     def wait(self, time, units="us"):
-        """Simple wait function with heartbeat messages.
-        This is suitable for longer waits (i.e. bus reset) to make sure
-        simulation still proceeds.
+        """Simple wait function.
+        Progress of longer waits (i.e. bus reset) is visible in messages of
+        the shared progress reporter, see ``heartbeat`` argument.
 
         Args:
             time (int): Time to wait.
@@ -91,57 +259,79 @@ class UsbTest:
                 When no *units* is given (``None``) the timestep is determined
                 by the simulator.
         """
-        beat = True
-
-        @cocotb.coroutine
-        def Heartbeat():
-            while beat:
-                yield Timer(1, units="ms")
-                ct = get_sim_time("us")
-                self.dut._log.info("Waiting, current time {:.0f}".format(ct))
-
-        yield [Timer(time, units="us"), Heartbeat()]
-        beat = False
+        yield Timer(time, units=units)
 
     @cocotb.coroutine
-    def port_reset(self, time=10e3, recover=False):
+    def port_reset(self, time=None, recover=False):
         """Send USB port reset - SE0 condition.
         According to USB Specification section 11.5.1.5, the duration
         of the Resetting state is nominally 10 ms to 20 ms
         (10 ms is preferred).
 
         Args:
-            time (int, optional): Duration of reset in us.
-            recover (bool, optional): Wait for allowed recovery period (10 ms)
-                after reset.
+            time (int, optional): Duration of reset in us. Taken from the
+                timing profile (10 ms for ``'spec'``) if not set.
+            recover (bool, optional): Wait for allowed recovery period (10 ms
+                for ``'spec'`` timing profile) after reset.
         """
+        if time is None:
+            time = self.timing.reset_time
         self.dut._log.info("[Resetting port for {} us]".format(time))
-        self.dut.usb_d_p = 0
-        self.dut.usb_d_n = 0
-
-        yield self.wait(time, "us")
-        self.connect()
-        if recover:
-            yield self.wait(1e4, "us")
+        # SOF packets are held off until the reset is over
+        yield self._bus_lock.acquire()
+        try:
+            self.dut.usb_d_p = 0
+            self.dut.usb_d_n = 0
+
+            yield self.wait(time, "us")
+            yield self._drive_idle()
+        finally:
+            self._bus_lock.release()
+        if recover and self.timing.reset_recovery > 0:
+            yield self.wait(self.timing.reset_recovery, "us")
 
     @cocotb.coroutine
-    def connect(self):
-        """Simulate FS connect to DUT  - DP pulled high."""
+    def _drive_idle(self):
         # FS connect - DP pulled high
         self.dut.usb_d_p = 1
         self.dut.usb_d_n = 0
         yield ClockCycles(self.dut.clk48_host, 10)
 
+    @cocotb.coroutine
+    def connect(self):
+        """Simulate FS connect to DUT  - DP pulled high."""
+        yield self._bus_lock.acquire()
+        try:
+            yield self._drive_idle()
+        finally:
+            self._bus_lock.release()
+
     @cocotb.coroutine
     def disconnect(self):
-        """Simulate device disconnect, both lines pulled low."""
-        # Detached - pulldowns on host side
-        self.dut.usb_d_p = 0
-        self.dut.usb_d_n = 0
-        yield ClockCycles(self.dut.clk48_host, 10)
+        """Simulate device disconnect, both lines pulled low.
+        The background SOF generator is stopped, see ``start_sof()``."""
+        self.stop_sof()
+        # Wait for a SOF packet already on the bus
+        yield self._bus_lock.acquire()
+        try:
+            # Detached - pulldowns on host side
+            self.dut.usb_d_p = 0
+            self.dut.usb_d_n = 0
+            yield ClockCycles(self.dut.clk48_host, 10)
+        finally:
+            self._bus_lock.release()
         # Device address should have reset
         self.address = 0
 
+    def _abort_transaction(self, deadline):
+        """Return the bus to idle after transfers bounded by *deadline* were
+        aborted. Their bus lock is released by then, unless another
+        transaction has already taken it over."""
+        self.monitor.state = self.monitor.IDLE
+        if not self._bus_lock.locked:
+            self.dut.usb_d_p = 1
+            self.dut.usb_d_n = 0
+
     def print_ep(self, epaddr, msg, *args):
         self.dut._log.info("ep(%i, %s): %s" %
                            (EndpointType.epnum(epaddr),
@@ -182,6 +372,78 @@ class UsbTest:
                 raise TestFailure("Unknown value: %s" % v)
             yield RisingEdge(self.dut.clk48_host)
 
+    @cocotb.coroutine
+    def _host_drive_runs(self, runs):
+        """Drive precomputed line state runs, see ``line_runs()``.
+
+        The host clock is free running, so once aligned to its edge a run
+        takes a single timer instead of a wakeup per clock cycle.
+        """
+        yield RisingEdge(self.dut.clk48_host)
+        for p, n, cycles in runs:
+            self.dut.usb_d_p <= p
+            self.dut.usb_d_n <= n
+            yield Timer(cycles * self.clock_period, 'ps')
+
+    @classmethod
+    def _get_sof_frames(cls):
+        if cls._sof_frames is None:
+            cls._sof_frames = [line_runs('JJJJJJJJ' +
+                                         wrap_packet(sof_packet(frame)))
+                               for frame in range(2**11)]
+        return cls._sof_frames
+
+    def start_sof(self, frame=0):
+        """Start sending SOF packets every frame in the background.
+
+        Packets are only sent between transactions; a SOF falling due during
+        a transaction is sent right after it completes.
+
+        Args:
+            frame (int, optional): Number of the first frame to be sent.
+        """
+        self.stop_sof()
+        self.frame = frame % 2**11
+        self._sof = cocotb.fork(self._sof_keepalive(self._sof_generation))
+
+    def stop_sof(self):
+        """Stop the background SOF generator.
+        A SOF packet already on the bus is completed first."""
+        if self._sof is None:
+            return
+        # Never kill the generator while it owns or waits for the bus lock
+        if self._sof_sleeping:
+            self._sof.kill()
+        self._sof_generation += 1
+        self._sof = None
+
+    @cocotb.coroutine
+    def _sof_keepalive(self, generation):
+        frames = self._get_sof_frames()
+        interval = get_sim_steps(self.SOF_INTERVAL, "us")
+        deadline = get_sim_time()
+        while generation == self._sof_generation:
+            deadline += interval
+            now = get_sim_time()
+            if deadline <= now:
+                # A transaction took longer than a frame, skip missed ones
+                missed = (now - deadline) // interval + 1
+                deadline += missed * interval
+                self.frame = (self.frame + missed) % 2**11
+            self._sof_sleeping = True
+            yield Timer(deadline - now)
+            self._sof_sleeping = False
+            yield self._bus_lock.acquire()
+            try:
+                if generation != self._sof_generation:
+                    # Stopped while waiting for the bus
+                    break
+                yield self._host_drive_runs(frames[self.frame])
+            finally:
+                self._bus_lock.release()
+            if generation == self._sof_generation:
+                self.frame = (self.frame + 1) % 2**11
+
     @cocotb.coroutine
     def host_send_token_packet(self, pid, addr, ep):
         yield self._host_send_packet(token_packet(pid, addr, ep))
@@ -204,59 +466,86 @@ class UsbTest:
         """Send data out the virtual USB connection, including an OUT token."""
         self.retry = True
         while self.retry:
-            # Do we still have time?
-            current = get_sim_time("us")
-            self.dut._log.info("Sending data at {:.0f}, deadline {:.0f}"
-                               .format(current, self.packet_deadline))
-            if current > self.packet_deadline:
-                raise TestFailure("Did not finish data transfer in time")
-
-            yield self.host_send_token_packet(PID.OUT, addr, epnum)
-            yield self.host_send_data_packet(data01, data)
-            yield self.host_expect_packet(handshake_packet(expected),
-                                          "Expected {} packet."
-                                          .format(expected))
+            self.dut._log.info("Sending data at {:.0f}"
+                               .format(get_sim_time("us")))
+            yield self._bus_lock.acquire()
+            try:
+                yield self.host_send_token_packet(PID.OUT, addr, epnum)
+                yield self.host_send_data_packet(data01, data)
+                yield self.host_expect_packet(handshake_packet(expected),
+                                              "Expected {} packet."
+                                              .format(expected))
+            finally:
+                self._bus_lock.release()
+            if self.retry:
+                # NAKed, let SOF and other transactions use the bus meanwhile
+                yield Timer(self.RETRY_INTERVAL, 'us')
 
     @cocotb.coroutine
-    def host_setup(self, addr, epnum, data):
+    def host_setup(self, addr, epnum, data, deadline=None):
         """Send data out the virtual USB connection, including a SETUP
-        token.
+        token. The transaction is retried for up to ``MAX_SETUP_TIME``,
+        or until the enclosing *deadline* passes.
         """
-        setup_deadline = get_sim_time("us") + 5e3  # Try for 5 ms
+        yield self.deadlines.run(self._host_setup(addr, epnum, data),
+                                 self.MAX_SETUP_TIME, "SETUP transaction",
+                                 parent=deadline)
+
+    @cocotb.coroutine
+    def _host_setup(self, addr, epnum, data):
         self.retry = True
         while self.retry:
-            # Do we still have time?
-            current = get_sim_time("us")
-            self.dut._log.info("Sending setup packet at {:.0f}, "
-                               "deadline {:.0f}".format(current,
-                                                        setup_deadline))
-            if current > setup_deadline:
-                raise TestFailure("Failed to send setup packet")
-
-            yield self.host_send_token_packet(PID.SETUP, addr, epnum)
-            yield self.host_send_data_packet(PID.DATA0, data)
-            yield self.host_expect_ack()
+            self.dut._log.info("Sending setup packet at {:.0f}"
+                               .format(get_sim_time("us")))
+            yield self._bus_lock.acquire()
+            try:
+                yield self.host_send_token_packet(PID.SETUP, addr, epnum)
+                yield self.host_send_data_packet(PID.DATA0, data)
+                yield self.host_expect_ack()
+            finally:
+                self._bus_lock.release()
+            if self.retry:
+                yield Timer(self.RETRY_INTERVAL, 'us')
 
     @cocotb.coroutine
     def host_recv(self, data01, addr, epnum, data):
         """Send data out the virtual USB connection, including an IN token."""
         self.retry = True
+        self.first_in_token = None
         while self.retry:
-            yield Timer(5, "us")
-            # Do we still have time?
-            current = get_sim_time("us")
-            self.dut._log.info("Getting data at {:.0f}, deadline {:.0f}"
-                               .format(current, self.packet_deadline))
-            if current > self.packet_deadline:
-                raise TestFailure("Did not receive data in time")
-
-            yield self.host_send_token_packet(PID.IN, addr, epnum)
-            yield self.host_expect_data_packet(data01, data)
-        yield self.host_send_ack()
+            yield Timer(self.IN_TOKEN_DELAY, "us")
+            self.dut._log.info("Getting data at {:.0f}"
+                               .format(get_sim_time("us")))
+            yield self._bus_lock.acquire()
+            try:
+                self.last_in_token = get_sim_time("us")
+                if self.first_in_token is None:
+                    self.first_in_token = self.last_in_token
+                yield self.host_send_token_packet(PID.IN, addr, epnum)
+                yield self.host_expect_data_packet(data01, data)
+                if not self.retry:
+                    yield self.host_send_ack()
+            finally:
+                self._bus_lock.release()
+            if self.retry:
+                yield Timer(self.RETRY_INTERVAL, 'us')
 
     # Device->Host
     @cocotb.coroutine
-    def host_expect_packet(self, packet, msg=None):
+    def host_expect_packet(self, packet, msg=None, expected=None):
+        """Expect a packet from the device.
+
+        On an unexpected NAK ``retry`` is left set, and the caller retries
+        the transaction after ``RETRY_INTERVAL``, once the bus lock is
+        released.
+
+        Args:
+            packet (str): Expected packet, as returned by ``data_packet()``
+                and similar functions.
+            msg (str, optional): Message of the error raised on mismatch.
+            expected (str, optional): Precomputed ``pp_packet()`` of wrapped
+                *packet*, used instead of *packet*.
+        """
         self.monitor.prime()
         result = yield self.monitor.wait_for_recv(1e9)  # 1 ms max
         if result is None:
@@ -268,12 +557,12 @@ class UsbTest:
         self.dut.usb_d_n = 0
 
         # Check the packet received matches
-        expected = pp_packet(wrap_packet(packet))
+        if expected is None:
+            expected = pp_packet(wrap_packet(packet))
         actual = pp_packet(result)
-        nak = pp_packet(wrap_packet(handshake_packet(PID.NAK)))
+        nak = self._nak_packet()
         if (actual == nak) and (expected != nak):
             self.dut._log.warning("Got NAK, retry")
-            yield Timer(self.RETRY_INTERVAL, 'us')
             return
         else:
             self.retry = False
@@ -285,6 +574,12 @@ class UsbTest:
                 Analyze.explain(actual, expected)
                 raise TestError(msg)
 
+    @classmethod
+    def _nak_packet(cls):
+        if cls._nak is None:
+            cls._nak = pp_packet(wrap_packet(handshake_packet(PID.NAK)))
+        return cls._nak
+
     @cocotb.coroutine
     def host_expect_ack(self):
         """Expect an ACK packet."""
@@ -309,16 +604,25 @@ class UsbTest:
 
         Args:
             pid: Either ``PID.DATA0`` or ``PID.DATA1``.
-            data: Expected values as list of bytes.
+            data: Expected values as list of bytes or ``ExpectedPacket``.
         """
         assert pid in (PID.DATA0, PID.DATA1), pid
+        if isinstance(data, ExpectedPacket):
+            if data.pid == pid:
+                yield self.host_expect_packet(
+                    None,
+                    "Expected %s packet with %r" % (pid.name,
+                                                    list(data.data)),
+                    data.expected)
+                return
+            data = list(data.data)
         yield self.host_expect_packet(
             data_packet(pid, data),
             "Expected %s packet with %r" % (pid.name, data))
 
     @cocotb.coroutine
-    def transaction_setup(self, addr, data, epnum=0):
-        xmit = cocotb.fork(self.host_setup(addr, epnum, data))
+    def transaction_setup(self, addr, data, epnum=0, deadline=None):
+        xmit = cocotb.fork(self.host_setup(addr, epnum, data, deadline))
         yield xmit.join()
 
     @cocotb.coroutine
@@ -328,39 +632,41 @@ class UsbTest:
                              data,
                              chunk_size=64,
                              datax=PID.DATA0,
-                             expected=PID.ACK):
-
-        for _i, chunk in enumerate(grouper_tofit(chunk_size, data)):
+                             expected=PID.ACK,
+                             deadline=None):
+        epnum = EndpointType.epnum(ep)
+        for _i, chunk in enumerate(out_chunks(data, chunk_size)):
             self.dut._log.warning("Sending {} bytes to device".format(
                 len(chunk)))
-            self.packet_deadline = (get_sim_time("us") +
-                                    self.MAX_DATA_PACKET_TIME)
-            xmit = cocotb.fork(
-                self.host_send(datax, addr, ep, chunk, expected))
-            yield xmit.join()
+            yield self.deadlines.run(
+                self.host_send(datax, addr, epnum, chunk, expected),
+                self.MAX_DATA_PACKET_TIME, "OUT data packet",
+                parent=deadline)
+
+            if datax == PID.DATA0:
+                datax = PID.DATA1
+            else:
+                datax = PID.DATA0
+        raise ReturnValue(datax)
 
     @cocotb.coroutine
-    def transaction_data_in(self, addr, ep, data, chunk_size=None):
+    def transaction_data_in(self, addr, ep, data, chunk_size=None,
+                            datax=PID.DATA1, deadline=None):
         epnum = EndpointType.epnum(ep)
-        datax = PID.DATA1
         sent_data = 0
         if chunk_size is None:
             chunk_size = self.max_packet_size
-        for i, chunk in enumerate(grouper_tofit(chunk_size, data)):
-            # Do we still have time?
-            current = get_sim_time("us")
-            if current > self.request_deadline:
-                raise TestFailure("Failed to get all data in time")
-
+        for i, (chunk, expected) in enumerate(in_chunks(data, chunk_size)):
             self.dut._log.debug("Expecting chunk {}".format(i))
-            self.packet_deadline = current + 5e2  # 500 ms
 
             sent_data = 1
             self.dut._log.debug(
                 "Actual data we're expecting: {}".format(chunk))
 
-            recv = cocotb.fork(self.host_recv(datax, addr, epnum, chunk))
-            yield recv.join()
+            yield self.deadlines.run(
+                self.host_recv(datax, addr, epnum, expected),
+                self.MAX_DATA_PACKET_TIME, "IN data packet",
+                parent=deadline)
 
             if datax == PID.DATA0:
                 datax = PID.DATA1
@@ -368,8 +674,15 @@ class UsbTest:
                 datax = PID.DATA0
 
         if not sent_data:
-            recv = cocotb.fork(self.host_recv(datax, addr, epnum, []))
-            yield recv.join()
+            yield self.deadlines.run(
+                self.host_recv(datax, addr, epnum, []),
+                self.MAX_DATA_PACKET_TIME, "IN data packet",
+                parent=deadline)
+            if datax == PID.DATA0:
+                datax = PID.DATA1
+            else:
+                datax = PID.DATA0
+        raise ReturnValue(datax)
 
     @cocotb.coroutine
     def transaction_status_in(self, addr, ep):
@@ -386,13 +699,16 @@ class UsbTest:
         yield xmit.join()
 
     @cocotb.coroutine
-    def control_transfer_out(self, addr, setup_data, descriptor_data=None):
+    def control_transfer_out(self, addr, setup_data, descriptor_data=None,
+                             deadline=None):
         """Perform an OUT control transfer.
 
         Args:
             addr (int): Device address.
             setup_data: Request to be sent, as list of bytes.
             descriptor_data (optional): Data to be sent, as list of bytes.
+            deadline (Deadline, optional): Enclosing deadline, e.g. of the
+                enumeration.
         """
         epaddr_out = EndpointType.epaddr(0, EndpointType.OUT)
         epaddr_in = EndpointType.epaddr(0, EndpointType.IN)
@@ -418,39 +734,42 @@ class UsbTest:
 
         # Setup stage
         self.dut._log.info("setup stage")
-        yield self.transaction_setup(addr, setup_data)
-        self.request_deadline = get_sim_time("us") + self.MAX_REQUEST_TIME
-
-        # Data stage
-        if descriptor_data is not None:
-            self.dut._log.info("data stage")
-            yield self.transaction_data_out(
-                    addr,
-                    epaddr_out,
-                    descriptor_data,
-                    datax=PID.DATA1)
-            yield RisingEdge(self.dut.clk48_host)
-
-        # Status stage
-        self.dut._log.info("status stage")
-        self.packet_deadline = get_sim_time("us") + self.MAX_PACKET_TIME
-        yield self.transaction_status_in(addr, epaddr_in)
-
-        # Was the time limit honored?
-        if get_sim_time("us") > self.request_deadline:
-            raise TestFailure("Failed to process the OUT request in time")
+        yield self.transaction_setup(addr, setup_data, deadline=deadline)
+        request = self.deadlines.open(self.MAX_REQUEST_TIME, "OUT request",
+                                      parent=deadline)
+        try:
+            # Data stage
+            if descriptor_data is not None:
+                self.dut._log.info("data stage")
+                yield self.transaction_data_out(addr,
+                                                epaddr_out,
+                                                descriptor_data,
+                                                datax=PID.DATA1,
+                                                deadline=request)
+                yield RisingEdge(self.dut.clk48_host)
+
+            # Status stage
+            self.dut._log.info("status stage")
+            yield self.deadlines.run(
+                self.transaction_status_in(addr, epaddr_in),
+                self.MAX_PACKET_TIME, "status stage", parent=request)
+        finally:
+            self.deadlines.close(request)
 
         yield RisingEdge(self.dut.clk48_host)
 
     @cocotb.coroutine
-    def control_transfer_in(self, addr, setup_data, descriptor_data=None):
+    def control_transfer_in(self, addr, setup_data, descriptor_data=None,
+                            deadline=None):
         """Perform an IN control transfer.
 
         Args:
             addr (int): Device address.
             setup_data: Request to be sent, as list of bytes.
             descriptor_data (optional): Data expected to be received, as list
-                of bytes.
+                of bytes or ``ExpectedPacket`` objects.
+            deadline (Deadline, optional): Enclosing deadline, e.g. of the
+                enumeration.
         """
         epaddr_out = EndpointType.epaddr(0, EndpointType.OUT)
         epaddr_in = EndpointType.epaddr(0, EndpointType.IN)
@@ -476,73 +795,84 @@ class UsbTest:
 
         # Setup stage
         self.dut._log.info("setup stage")
-        self.packet_deadline = get_sim_time("us") + self.MAX_PACKET_TIME
-        yield self.transaction_setup(addr, setup_data)
-        self.request_deadline = get_sim_time("us") + self.MAX_REQUEST_TIME
-
-        if descriptor_data is not None:
-            # Data stage
-            self.dut._log.info("data stage")
-            yield self.transaction_data_in(addr, epaddr_in, descriptor_data)
-
-        # Give the signal one clock cycle to perccolate through
-        # the event manager
-        yield RisingEdge(self.dut.clk48_host)
-
-        # Status stage
-        self.dut._log.info("status stage")
-        self.packet_deadline = get_sim_time("us") + self.MAX_PACKET_TIME
-        yield self.transaction_status_out(addr, epaddr_out)
+        yield self.transaction_setup(addr, setup_data, deadline=deadline)
+        request = self.deadlines.open(self.MAX_REQUEST_TIME, "IN request",
+                                      parent=deadline)
+        try:
+            if descriptor_data is not None:
+                # Data stage
+                self.dut._log.info("data stage")
+                yield self.transaction_data_in(addr, epaddr_in,
+                                               descriptor_data,
+                                               deadline=request)
+
+            # Give the signal one clock cycle to perccolate through
+            # the event manager
+            yield RisingEdge(self.dut.clk48_host)
 
-        # Was the time limit honored?
-        if get_sim_time("us") > self.request_deadline:
-            raise TestFailure("Failed to process the IN request in time")
+            # Status stage
+            self.dut._log.info("status stage")
+            yield self.deadlines.run(
+                self.transaction_status_out(addr, epaddr_out),
+                self.MAX_PACKET_TIME, "status stage", parent=request)
+        finally:
+            self.deadlines.close(request)
 
         yield RisingEdge(self.dut.clk48_host)
 
     @cocotb.coroutine
-    def set_device_address(self, address, skip_recovery=False):
+    def set_device_address(self, address, skip_recovery=False,
+                           deadline=None):
         """Set USB device address.
-        After the transaction host will wait for 2 ms recovery period,
+        After the transaction host will wait for 2 ms recovery period
+        (shortened by ``'fast'`` and ``'minimal'`` timing profiles),
         during which device is not required to respond.
 
         Args:
             address (int): Value to be set.
             skip_recovery (bool, optional): Skip the recovery period wait.
+            deadline (Deadline, optional): Enclosing deadline, e.g. of the
+                enumeration.
         """
         self.dut._log.info("[Setting device address to {}]".format(address))
         yield self.control_transfer_out(
             self.address,
             setAddressRequest(address),
             None,
+            deadline=deadline,
         )
         # Device is allowed a "recovery period" of 2 ms after status phase
         # see section 9.2.6.3 of USB spec
-        if not skip_recovery:
-            yield self.wait(2e3, "us")
+        if not skip_recovery and self.timing.address_recovery > 0:
+            yield self.wait(self.timing.address_recovery, "us")
         self.address = address
 
     @cocotb.coroutine
-    def get_device_descriptor(self, response, length=18):
+    def get_device_descriptor(self, response, length=18, deadline=None):
         """Read the device descriptor from DUT.
 
         Args:
             response: Expected descriptor contents as list of bytes.
+            deadline (Deadline, optional): Enclosing deadline, e.g. of the
+                enumeration.
         """
         self.dut._log.info("[Getting device descriptor]")
         request = getDescriptorRequest(descriptor_type=Descriptor.Types.DEVICE,
                                        descriptor_index=0,
                                        lang_id=Descriptor.LangId.UNSPECIFIED,
                                        length=length)
-        yield self.control_transfer_in(self.address, request, response)
+        yield self.control_transfer_in(self.address, request, response,
+                                       deadline=deadline)
 
     @cocotb.coroutine
-    def get_configuration_descriptor(self, length, response):
+    def get_configuration_descriptor(self, length, response, deadline=None):
         """Read a configuration descriptor from DUT.
 
         Args:
             length (int): Number of bytes to be read.
             response: Expected descriptor contents as list of bytes.
+            deadline (Deadline, optional): Enclosing deadline, e.g. of the
+                enumeration.
         """
         self.dut._log.info("[Getting config descriptor]")
         request = getDescriptorRequest(
@@ -551,16 +881,20 @@ class UsbTest:
             lang_id=Descriptor.LangId.UNSPECIFIED,
             length=length)
 
-        yield self.control_transfer_in(self.address, request, response)
+        yield self.control_transfer_in(self.address, request, response,
+                                       deadline=deadline)
 
     @cocotb.coroutine
-    def get_string_descriptor(self, lang_id, idx, response, length=255):
+    def get_string_descriptor(self, lang_id, idx, response, length=255,
+                              deadline=None):
         """Read a string descriptor from DUT.
 
         Args:
             lang_id (int): Language ID of descriptor.
             idx (int): Descriptor index.
             response: Expected descriptor contents as list of bytes.
+            deadline (Deadline, optional): Enclosing deadline, e.g. of the
+                enumeration.
         """
         self.dut._log.info("[Getting string descriptor {} of langId {:#x}]"
                            .format(idx, lang_id))
@@ -569,15 +903,18 @@ class UsbTest:
                                        lang_id=lang_id,
                                        length=length)
 
-        yield self.control_transfer_in(self.address, request, response)
+        yield self.control_transfer_in(self.address, request, response,
+                                       deadline=deadline)
 
     @cocotb.coroutine
-    def get_device_qualifier(self, length, response):
+    def get_device_qualifier(self, length, response, deadline=None):
         """Read a device qualifier descriptor from DUT.
 
         Args:
             length (int): Number of bytes to be read.
             response: Expected descriptor contents as list of bytes.
+            deadline (Deadline, optional): Enclosing deadline, e.g. of the
+                enumeration.
         """
         self.dut._log.info("[Getting device qualifier descriptor]")
         request = getDescriptorRequest(
@@ -586,14 +923,17 @@ class UsbTest:
             lang_id=Descriptor.LangId.UNSPECIFIED,
             length=length)
 
-        yield self.control_transfer_in(self.address, request, response)
+        yield self.control_transfer_in(self.address, request, response,
+                                       deadline=deadline)
 
     @cocotb.coroutine
-    def set_configuration(self, idx):
+    def set_configuration(self, idx, deadline=None):
         """Send a SET_CONFIGURATION standard device request to DUT.
 
         Args:
             idx (int): Configuration number to be set.
+            deadline (Deadline, optional): Enclosing deadline, e.g. of the
+                enumeration.
         """
         request = setConfigurationRequest(idx)
 
@@ -602,4 +942,81 @@ class UsbTest:
             self.address,
             request,
             None,
+            deadline=deadline,
         )
+
+    @cocotb.coroutine
+    def enumerate(self, device, address=1, fast=False, timeout=None):
+        """Run the standard enumeration sequence against DUT.
+
+        Expected responses are taken from the response table of *device*
+        (see ``enumeration_data()``) before any traffic is generated, so
+        descriptors changed after loading are expected too. The whole
+        sequence shares a single deadline.
+
+        Args:
+            device (UsbDevice, DescriptorBundle or path): Descriptors the DUT
+                is expected to report. A path to a device JSON file is
+                loaded with ``compile_device()``, so it is only parsed when
+                the file changes.
+            address (int, optional): Address to be assigned to the device.
+            fast (bool, optional): Use the bus reset of ``'minimal'`` timing
+                profile, skip the recovery periods, the 9-byte configuration
+                read and string descriptors. Suitable for tests that only
+                need a configured device.
+            timeout (int, optional): Time limit for the whole sequence in us,
+                ``MAX_ENUMERATION_TIME`` by default.
+
+        Returns:
+            dict: Simulation time spent in every stage, in us.
+        """
+        if timeout is None:
+            timeout = self.MAX_ENUMERATION_TIME
+        expected = enumeration_data(device, self.max_packet_size,
+                                    strings=not fast)
+
+        # Every stage is called with the enumeration deadline, so that
+        # transfers it starts are bounded by it too
+        stages = []
+        if fast:
+            stages.append(("reset", lambda d: self.port_reset(
+                get_profile("minimal").reset_time)))
+        else:
+            stages.append(("reset", lambda d: self.port_reset(recover=True)))
+        stages.append(("device descriptor",
+                       lambda d: self.get_device_descriptor(
+                           expected.device, length=expected.device_length,
+                           deadline=d)))
+        stages.append(("address", lambda d: self.set_device_address(
+            address, skip_recovery=fast, deadline=d)))
+        if not fast:
+            stages.append(("configuration header",
+                           lambda d: self.get_configuration_descriptor(
+                               9, expected.config_header, deadline=d)))
+        stages.append(("configuration descriptor",
+                       lambda d: self.get_configuration_descriptor(
+                           expected.config_length, expected.config,
+                           deadline=d)))
+        for lang_id, idx, data in expected.strings:
+            stages.append(("string {} of langId {:#x}".format(idx, lang_id),
+                           lambda d, lang_id=lang_id, idx=idx, data=data:
+                           self.get_string_descriptor(lang_id, idx, data,
+                                                      deadline=d)))
+        stages.append(("configuration", lambda d: self.set_configuration(
+            expected.configuration_value, deadline=d)))
+
+        timings = {}
+        start = get_sim_time("us")
+        last = start
+        deadline = self.deadlines.open(timeout, "enumeration")
+        try:
+            for name, stage in stages:
+                yield self.deadlines.run(stage(deadline), name=name,
+                                         parent=deadline)
+                current = get_sim_time("us")
+                timings[name] = current - last
+                last = current
+        finally:
+            self.deadlines.close(deadline)
+        self.dut._log.info("[Enumerated in {:.0f} us]".format(last - start))
+        raise ReturnValue(timings)
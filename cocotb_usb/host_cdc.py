@@ -0,0 +1,210 @@
+import time
+from collections import namedtuple
+
+import cocotb
+from cocotb.result import ReturnValue
+from cocotb.utils import get_sim_time
+
+from cocotb_usb.descriptors import EndpointDescriptor
+from cocotb_usb.descriptors.cdc import (CDC, LineCodingStructure,
+                                        setLineCoding, setControlLineState)
+from cocotb_usb.usb.endpoint import EndpointType
+from cocotb_usb.usb.pid import PID
+from cocotb_usb.utils import record_properties
+
+
+class CdcThroughput(namedtuple("CdcThroughput", ["size",
+                                                 "transfers",
+                                                 "sim_time",
+                                                 "wall_time"])):
+    """Summary of a CDC-ACM loopback run.
+
+    Args:
+        size (int): Payload size in bytes, sent and received back.
+        transfers (int): Number of OUT transfers the payload was split into.
+        sim_time (float): Simulated duration in us.
+        wall_time (float): Wall-clock duration in s.
+
+    .. doctest::
+
+        >>> r = CdcThroughput(4096, 4, 2048e3, 8.192)
+        >>> r.bytes_per_second
+        2000.0
+        >>> r.wall_per_byte
+        0.002
+    """
+    __slots__ = ()
+
+    @property
+    def bytes_per_second(self):
+        """Payload bytes per simulated second."""
+        return self.size * 1e6 / max(self.sim_time, 1e-9)
+
+    @property
+    def wall_per_byte(self):
+        """Wall-clock seconds spent per payload byte."""
+        return self.wall_time / max(self.size, 1)
+
+
+def record_throughput(result, test_name):
+    """Store benchmark results as properties in the test results."""
+    record_properties(test_name, "cdc",
+                      dict(result._asdict(),
+                           bytes_per_second=result.bytes_per_second,
+                           wall_per_byte=result.wall_per_byte))
+
+
+class CdcLoopback:
+    """CDC-ACM loopback benchmark.
+
+    Configures the serial line of a CDC-ACM device, then streams a payload
+    to its bulk OUT endpoint and expects the same data back on its bulk IN
+    endpoint. Interface and endpoints are looked up in the parsed
+    descriptors of *device*. Data toggles of both endpoints are kept
+    across transfers.
+
+    Harnesses that stand in for the device firmware (``UsbTestValenty``)
+    load the IN FIFO with the bytes the device read out of its OUT FIFO,
+    not with the payload, so the echo is checked through the core.
+
+    Args:
+        harness (UsbTest): Test harness used to perform the transfers.
+        addr (int): Device address.
+        device (UsbDevice): Device model.
+        configuration (int, optional): ``bConfigurationValue`` of the
+            configuration to use. If ``None``, the first one is used.
+        line_coding (LineCodingStructure, optional): Line settings sent with
+            SET_LINE_CODING, 115200 8N1 by default.
+
+    Example::
+
+        cdc = CdcLoopback(harness, addr=20, device=device)
+        yield cdc.configure()
+        result = yield cdc.benchmark(size=4096)
+    """
+    def __init__(self,
+                 harness,
+                 addr,
+                 device,
+                 configuration=None,
+                 line_coding=None):
+        self.harness = harness
+        self.addr = addr
+        if configuration is None:
+            configuration = min(device.index)
+        index = device.index[configuration]
+        comm = [intf for intf in index.interfaces.values()
+                if intf.bInterfaceClass == CDC.Type.COMM]
+        if not comm:
+            raise ValueError("No CDC communication interface found")
+        self.interface = comm[0].bInterfaceNumber
+        self.epaddr_out, self.ep_out = self._find_bulk(
+            index, EndpointDescriptor.Direction.OUT)
+        self.epaddr_in, self.ep_in = self._find_bulk(
+            index, EndpointDescriptor.Direction.IN)
+        self.max_packet_size = min(self.ep_out.wMaxPacketSize,
+                                   self.ep_in.wMaxPacketSize)
+        if line_coding is None:
+            line_coding = LineCodingStructure(
+                dwDTERate=115200,
+                bCharFormat=LineCodingStructure.STOP_BITS_1,
+                bParityType=LineCodingStructure.PARITY_NONE,
+                bDataBits=LineCodingStructure.DATA_BITS_8)
+        self.line_coding = line_coding
+        self.datax_out = PID.DATA0
+        self.datax_in = PID.DATA0
+        self.log = harness.dut._log
+
+    @staticmethod
+    def _find_bulk(index, direction):
+        """Return harness address (see ``EndpointType``) and descriptor of
+        the bulk endpoint used in *direction*.
+
+        .. doctest::
+
+            >>> from cocotb_usb.descriptors import InterfaceDescriptor
+            >>> from cocotb_usb.descriptors import ConfigDescriptor
+            >>> from cocotb_usb.device import ConfigIndex
+            >>> i = InterfaceDescriptor(9, 1, 0, 2, CDC.Type.DATA, 0, 0, 0,
+            ...     subdescriptors=[EndpointDescriptor(7, 0x01, 2, 64, 0),
+            ...                     EndpointDescriptor(7, 0x81, 2, 64, 0)])
+            >>> c = ConfigDescriptor(9, 32, 1, 1, 0, 0x80, 50, interfaces=[i])
+            >>> epaddr, ep = CdcLoopback._find_bulk(
+            ...     ConfigIndex(c), EndpointDescriptor.Direction.IN)
+            >>> hex(ep.bEndpointAddress), epaddr
+            ('0x81', 3)
+            >>> EndpointType.epnum(epaddr), EndpointType.epdir(epaddr).name
+            (1, 'IN')
+        """
+        found = index.find_endpoints(EndpointDescriptor.TransferType.BULK,
+                                     direction)
+        if not found:
+            raise ValueError("No bulk {} endpoint found".format(
+                "IN" if direction else "OUT"))
+        # Prefer endpoints of the CDC data interface
+        data = [ep for intf, ep in found
+                if intf.bInterfaceClass == CDC.Type.DATA]
+        ep = data[0] if data else found[0][1]
+        return EndpointType.from_descriptor(ep.bEndpointAddress), ep
+
+    @cocotb.coroutine
+    def configure(self, rts=True, dtr=True):
+        """Send SET_LINE_CODING and SET_CONTROL_LINE_STATE requests."""
+        yield self.harness.control_transfer_out(
+            self.addr, setLineCoding(self.interface), self.line_coding.get())
+        yield self.harness.control_transfer_out(
+            self.addr, setControlLineState(self.interface, rts, dtr), None)
+
+    @cocotb.coroutine
+    def transfer(self, data):
+        """Send *data* to the device and expect it to be echoed back.
+
+        Args:
+            data (bytes-like or list): Data to be sent.
+        """
+        self.datax_out = yield self.harness.transaction_data_out(
+            self.addr, self.epaddr_out, data,
+            chunk_size=self.max_packet_size, datax=self.datax_out)
+        kwargs = {}
+        received = getattr(self.harness, "out_received", None)
+        if received is not None:
+            kwargs["fill"] = received
+        self.datax_in = yield self.harness.transaction_data_in(
+            self.addr, self.epaddr_in, data,
+            chunk_size=self.max_packet_size, datax=self.datax_in, **kwargs)
+
+    @cocotb.coroutine
+    def benchmark(self, size=4096, transfer_size=None, payload=None):
+        """Stream a payload through the loopback and measure throughput.
+
+        Args:
+            size (int, optional): Payload size in bytes, if *payload* is not
+                given. The payload is a repeated 0..255 byte pattern.
+            transfer_size (int, optional): Bytes sent before the echo is read
+                back. Defaults to a single packet of the bulk endpoints.
+            payload (bytes-like, optional): Data to be sent.
+
+        Returns:
+            CdcThroughput: Size and duration of the run.
+        """
+        if payload is None:
+            payload = bytes(i & 0xFF for i in range(size))
+        if transfer_size is None:
+            transfer_size = self.max_packet_size
+        view = memoryview(payload)
+        start_sim = get_sim_time("us")
+        start_wall = time.time()
+        transfers = 0
+        for offset in range(0, len(view), transfer_size):
+            yield self.transfer(view[offset:offset + transfer_size])
+            transfers += 1
+
+        result = CdcThroughput(len(view), transfers,
+                               get_sim_time("us") - start_sim,
+                               time.time() - start_wall)
+        self.log.info("CDC loopback of {} bytes in {} transfers: {:.0f} B/s "
+                      "simulated, {:.2f} ms wall-clock per byte"
+                      .format(result.size, transfers,
+                              result.bytes_per_second,
+                              result.wall_per_byte * 1e3))
+        raise ReturnValue(result)
@@ -0,0 +1,214 @@
+import mmap
+import os
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import cocotb
+from cocotb.triggers import Timer
+from cocotb.result import ReturnValue
+from cocotb.utils import get_sim_time
+
+from cocotb_usb.descriptors.dfu import (DFU_CLASS_CODE, DfuAttributes,
+                                        DfuFunctionalDescriptor, DfuState,
+                                        dnloadRequest, getStatusRequest,
+                                        statusResponse)
+
+DfuThroughput = namedtuple("DfuThroughput", ["size",
+                                             "blocks",
+                                             "sim_time",
+                                             "wall_time"])
+DfuThroughput.__doc__ = """Summary of a DFU download.
+
+    Args:
+        size (int): Image size in bytes.
+        blocks (int): Number of DFU_DNLOAD requests carrying data.
+        sim_time (float): Simulated duration of the download in us,
+            including manifestation.
+        wall_time (float): Wall-clock duration of the download in s.
+"""
+
+
+def find_dfu_interface(device):
+    """Return ``(bInterfaceNumber, DfuFunctionalDescriptor)`` of the first
+    DFU interface of *device* (a ``UsbDevice``).
+
+    Raises:
+        ValueError: No interface with a DFU functional descriptor found.
+    """
+    for value in sorted(device.index):
+        interfaces = device.index[value].interfaces
+        for key in sorted(interfaces):
+            intf = interfaces[key]
+            if intf.bInterfaceClass != DFU_CLASS_CODE:
+                continue
+            for desc in intf.subdescriptors:
+                if isinstance(desc, DfuFunctionalDescriptor):
+                    return intf.bInterfaceNumber, desc
+    raise ValueError("No DFU functional descriptor found")
+
+
+@contextmanager
+def map_image(image):
+    """Map a firmware image for reading, yielding a ``memoryview`` of it.
+
+    Args:
+        image (str or bytes-like): Path to the image file. Buffers are used
+            as they are.
+    """
+    if not isinstance(image, str):
+        with memoryview(image) as view:
+            yield view
+        return
+    with open(image, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # mmap refuses empty files
+            yield memoryview(b"")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                yield view
+
+
+class DfuDownload:
+    """DFU download engine.
+
+    Streams a firmware image to the device as DFU_DNLOAD requests of
+    ``wTransferSize`` bytes, reading the expected state back with
+    DFU_GETSTATUS after each block, and runs the manifestation phase.
+
+    The image is memory-mapped and copied out one block at a time, so no
+    view of the mapping outlives it.
+
+    Args:
+        harness (UsbTest): Test harness used to perform the transfers.
+        addr (int): Device address.
+        device (UsbDevice, optional): Device model. If given, DFU interface
+            number, transfer size and manifestation tolerance are taken
+            from its DFU functional descriptor.
+        interface (int, optional): DFU interface number.
+        transfer_size (int, optional): Size of DFU_DNLOAD blocks.
+        manifestation_tolerant (bool, optional): Whether the device answers
+            DFU_GETSTATUS after manifestation instead of waiting for a
+            bus reset.
+
+    Example::
+
+        dfu = DfuDownload(harness, addr=20, device=device)
+        result = yield dfu.download("firmware.bin", poll_timeout=5)
+    """
+    def __init__(self,
+                 harness,
+                 addr,
+                 device=None,
+                 interface=0,
+                 transfer_size=1024,
+                 manifestation_tolerant=True):
+        self.harness = harness
+        self.addr = addr
+        self.interface = interface
+        self.transfer_size = transfer_size
+        self.manifestation_tolerant = manifestation_tolerant
+        if device is not None:
+            self.interface, functional = find_dfu_interface(device)
+            self.transfer_size = functional.wTransferSize
+            tolerant = DfuAttributes.ManifestationTolerant.YES
+            self.manifestation_tolerant = bool(functional.bmAttributes &
+                                               tolerant)
+        self.log = harness.dut._log
+
+    @cocotb.coroutine
+    def get_status(self, bState, bwPollTimeout=0):
+        """Read DFU status, expecting state *bState* and *bwPollTimeout*
+        (in ms), then wait for that timeout before the device may be polled
+        again."""
+        yield self.harness.control_transfer_in(
+            self.addr,
+            getStatusRequest(self.interface),
+            statusResponse(bState, bwPollTimeout))
+        if bwPollTimeout:
+            yield Timer(bwPollTimeout, units="ms")
+
+    @cocotb.coroutine
+    def download_block(self, block, data, poll_timeout=0, idle_timeout=0):
+        """Send a single DFU_DNLOAD request and wait until it is written.
+
+        Args:
+            block (int): Block number.
+            data (bytes): Block contents.
+            poll_timeout (int, optional): ``bwPollTimeout`` the device reports
+                in dfuDNBUSY while writing the block. If 0, the device is
+                expected to be in dfuDNLOAD-IDLE right away.
+            idle_timeout (int, optional): ``bwPollTimeout`` the device reports
+                in dfuDNLOAD-IDLE.
+        """
+        yield self.harness.control_transfer_out(
+            self.addr,
+            dnloadRequest(self.interface, block, len(data)),
+            data if len(data) else None)
+        if poll_timeout:
+            yield self.get_status(DfuState.DFU_DNBUSY, poll_timeout)
+        yield self.get_status(DfuState.DFU_DNLOAD_IDLE, idle_timeout)
+
+    @cocotb.coroutine
+    def manifest(self, block, manifest_timeout=0, idle_timeout=0):
+        """Start manifestation with a zero-length DFU_DNLOAD request.
+
+        Args:
+            block (int): Block number following the last data block.
+            manifest_timeout (int, optional): ``bwPollTimeout`` the device
+                reports in dfuMANIFEST.
+            idle_timeout (int, optional): ``bwPollTimeout`` a manifestation
+                tolerant device reports in dfuIDLE afterwards.
+        """
+        yield self.harness.control_transfer_out(
+            self.addr, dnloadRequest(self.interface, block, 0), None)
+        yield self.get_status(DfuState.DFU_MANIFEST, manifest_timeout)
+        if self.manifestation_tolerant:
+            yield self.get_status(DfuState.DFU_IDLE, idle_timeout)
+        else:
+            self.log.info("DFU manifestation done, device waits for reset")
+
+    @cocotb.coroutine
+    def download(self, image, poll_timeout=0, manifest_timeout=0,
+                 idle_timeout=0):
+        """Download a firmware image to the device.
+
+        Args:
+            image (str or bytes-like): Path to the image file, or the image
+                itself.
+            poll_timeout (int, optional): ``bwPollTimeout`` (in ms) reported
+                while a block is written, see ``download_block()``.
+            manifest_timeout (int, optional): ``bwPollTimeout`` (in ms)
+                reported during manifestation.
+            idle_timeout (int, optional): ``bwPollTimeout`` (in ms)
+                reported in dfuDNLOAD-IDLE and dfuIDLE.
+
+        Returns:
+            DfuThroughput: Size and duration of the download.
+        """
+        start_sim = get_sim_time("us")
+        start_wall = time.time()
+        with map_image(image) as view:
+            size = len(view)
+            blocks = 0
+            for offset in range(0, size, self.transfer_size):
+                # Copy, the mapping is closed while the harness may still
+                # hold the data
+                data = bytes(view[offset:offset + self.transfer_size])
+                self.log.info("DFU block {}, {} bytes".format(blocks,
+                                                              len(data)))
+                yield self.download_block(blocks, data, poll_timeout,
+                                          idle_timeout)
+                blocks += 1
+        yield self.manifest(blocks, manifest_timeout, idle_timeout)
+
+        result = DfuThroughput(size, blocks,
+                               get_sim_time("us") - start_sim,
+                               time.time() - start_wall)
+        self.log.info("DFU download of {} bytes in {} blocks took {:.0f} us "
+                      "({:.1f} kB/s simulated), {:.1f} s wall-clock"
+                      .format(size, blocks, result.sim_time,
+                              size * 1e3 / max(result.sim_time, 1e-9),
+                              result.wall_time))
+        raise ReturnValue(result)
@@ -1,16 +1,18 @@
 import cocotb
-from cocotb.triggers import RisingEdge
+from cocotb.triggers import RisingEdge, Timer, First
 from cocotb.result import TestFailure, ReturnValue
 from cocotb.utils import get_sim_time
 
 from cocotb_usb.usb.pid import PID
 from cocotb_usb.usb.endpoint import EndpointType, EndpointResponse
-from cocotb_usb.usb.packet import crc16
+from cocotb_usb.usb.packet import (crc16, transaction_time, packet_bits,
+                                   BIT_TIME, TURNAROUND_BITS)
 
-from cocotb_usb.utils import grouper_tofit, parse_csr, assertEqual
+from cocotb_usb.utils import parse_csr, assertEqual, get_field, set_field
 
-from cocotb_usb.host import UsbTest
+from cocotb_usb.host import UsbTest, in_chunks, out_chunks
 import inspect
+import math
 
 
 class UsbTestValenty(UsbTest):
@@ -25,93 +27,269 @@ class UsbTestValenty(UsbTest):
         decouple_clocks (bool, optional): Indicates whether host and device
             share clock signal. If set to False, you must provide clk48_device
             clock in test.
+        posted_writes (bool, optional): Queue CSR writes and return
+            immediately instead of waiting for each one to be acknowledged.
+            Reads and ``flush()`` wait for queued writes to complete.
+        irq (str, optional): Dotted path (relative to *dut*) of the core's
+            interrupt line or an event pending net. If given, the device side
+            waits for its rising edge instead of polling status registers,
+            with polling as the fallback on timeout.
+        backdoor (bool or str, optional): Access CSRs directly through
+            simulator handles instead of the Wishbone bus, in zero simulation
+            time. A string gives the dotted path (relative to *dut*) of the
+            module containing CSR nets. Registers with side effects on
+            access (FIFOs, control strobes, event pending) always go through
+            the bus, as do accesses while a net holds X/Z bits.
+        pipeline_in (bool, optional): Overlap the IN FIFO fill of each
+            chunk of ``transaction_data_in()`` with the host's delay before
+            its IN token and the token itself, timed from the fill rate of
+            the previous chunk so that the endpoint is armed by the time the
+            device answers the token. The core has a single IN buffer, so
+            the next chunk cannot be preloaded while the host fetches the
+            current one.
+        wb_stats (bool, optional): Collect Wishbone bus statistics in
+            ``wb.stats``, i.e. to be saved with ``wb.stats.dump(path)`` at
+            the end of a test.
     """
+
+    # CSRs whose access triggers an action in the core
+    FRONTDOOR_ONLY = ("_data", "_ctrl", "_ev_pending")
+
+    # Width of a CSR word on the bus, multi-word CSRs are split in these
+    CSR_DATA_WIDTH = 8
+
+    # Bit fields (offset, width) of endpoint status registers
+    STATUS_EPNO = (0, 4)
+    STATUS_HAVE = (4, 1)    # FIFO holds data
+    # Bit fields of endpoint control registers
+    CTRL_EPNO = (0, 4)
+    CTRL_ENABLE = (4, 1)    # Accept the next packet
+    CTRL_RESET = (5, 1)     # Empty the FIFO
+
+    # Clock cycles to wait for data before giving up
+    PRIME_CYCLES = 128
+
     def __init__(self, dut, csr_file, **kwargs):
         # Litex imports
         from cocotb_usb.wishbone import WishboneMaster
 
-        self.wb = WishboneMaster(dut, "wishbone", dut.clk12, timeout=20)
-        self.csrs = dict()
+        self.wb = WishboneMaster(dut, "wishbone", dut.clk12, timeout=20,
+                                 stats=kwargs.pop('wb_stats', False))
         self.csrs = parse_csr(csr_file)
+        # Register addresses as attributes, for use on the hot path
+        self.csr = self.csrs.addr
+        self.posted_writes = kwargs.pop('posted_writes', False)
+        self.irq = None
+        irq = kwargs.pop('irq', None)
+        if irq is not None:
+            self.irq = dut
+            for name in irq.split('.'):
+                self.irq = getattr(self.irq, name)
+        self.pipeline_in = kwargs.pop('pipeline_in', False)
+        # Data read out of the OUT FIFO by the last transaction_data_out()
+        self.out_received = []
+        self.backdoor = {}
+        backdoor = kwargs.pop('backdoor', False)
         kwargs['test_name'] = inspect.stack()[2][3]
         super().__init__(dut, **kwargs)
+        # Longest wait for an interrupt before polling: the packet may be
+        # sent after a retry interval and take a whole transaction
+        # (in whole us, Timer only takes values the simulator can represent)
+        self.irq_timeout = (math.ceil(transaction_time(self.max_packet_size)) +
+                            self.RETRY_INTERVAL)
+        # Time (in us) from the start of the host's IN token delay until
+        # the device answers the token, the data has to be ready by then
+        self.in_fill_time = (self.IN_TOKEN_DELAY +
+                             (packet_bits(2) + TURNAROUND_BITS) * BIT_TIME)
+        if backdoor:
+            self.backdoor = self._map_backdoor(
+                "" if backdoor is True else backdoor)
 
     @cocotb.coroutine
     def reset(self):
         yield super().reset()
 
         # Enable endpoint 0
-        yield self.write(self.csrs['usb_setup_ev_enable'], 0xff)
-        yield self.write(self.csrs['usb_in_ev_enable'], 0xff)
-        yield self.write(self.csrs['usb_out_ev_enable'], 0xff)
-
-        yield self.write(self.csrs['usb_setup_ev_pending'], 0xff)
-        yield self.write(self.csrs['usb_in_ev_pending'], 0xff)
-        yield self.write(self.csrs['usb_out_ev_pending'], 0xff)
-        yield self.write(self.csrs['usb_address'], 0)
+        yield self.write(self.csr.usb_setup_ev_enable, 0xff)
+        yield self.write(self.csr.usb_in_ev_enable, 0xff)
+        yield self.write(self.csr.usb_out_ev_enable, 0xff)
+
+        yield self.write(self.csr.usb_setup_ev_pending, 0xff)
+        yield self.write(self.csr.usb_in_ev_pending, 0xff)
+        yield self.write(self.csr.usb_out_ev_pending, 0xff)
+        yield self.write(self.csr.usb_address, 0)
+        yield self.flush()
+
+    def _map_backdoor(self, path):
+        """Map CSR word addresses to handles of their storage/status nets,
+        along with the offset of the word in the net.
+
+        Storage nets are named ``*_storage_full`` by older LiteX releases
+        and ``*_storage`` by newer ones, both are looked up. CSRs without
+        a net found stay on the front door (Wishbone), which is logged.
+        """
+        scope = self.dut
+        for name in filter(None, path.split('.')):
+            scope = getattr(scope, name)
+        handles = {}
+        for name, reg in self.csrs.registers.items():
+            if name.endswith(self.FRONTDOOR_ONLY):
+                continue
+            for suffix in ("_storage_full", "_storage", "_status"):
+                try:
+                    handle = getattr(scope, name + suffix)
+                    break
+                except AttributeError:
+                    pass
+            else:
+                self.dut._log.info("No backdoor net for {}, accessing it "
+                                   "through the bus".format(name))
+                continue
+            # Multi-word CSRs start with the most significant word
+            for i in range(reg.size):
+                offset = (reg.size - 1 - i) * self.CSR_DATA_WIDTH
+                handles[reg.address + 4 * i] = (handle, offset)
+        self.dut._log.info("Backdoor access to {} of {} CSRs".format(
+            len({h for h, _ in handles.values()}), len(self.csrs)))
+        return handles
+
+    def _backdoor_value(self, addr):
+        """Return value of the CSR net behind *addr*, or ``None`` if it is
+        not resolvable (X/Z)."""
+        value = self.backdoor[addr][0].value
+        if not value.is_resolvable:
+            return None
+        return value.integer
 
     @cocotb.coroutine
     def write(self, addr, val):
-        yield self.wb.write(addr, val)
+        self.csrs.check_write(addr)
+        if addr in self.backdoor:
+            # Keep the order with writes still queued for the bus
+            yield self.flush()
+            handle, offset = self.backdoor[addr]
+            current = self._backdoor_value(addr)
+            if current is not None:
+                handle.setimmediatevalue(set_field(
+                    current, offset, self.CSR_DATA_WIDTH, val))
+                return
+            self.dut._log.debug("Unresolvable CSR value, writing {:#x} over "
+                                "the bus".format(addr))
+        if self.posted_writes:
+            self.wb.post_write(addr, val)
+        else:
+            yield self.wb.write(addr, val)
+
+    @cocotb.coroutine
+    def write_burst(self, addr, values):
+        """Write a sequence of values to one register in a single bus
+        cycle."""
+        self.csrs.check_write(addr)
+        if self.posted_writes:
+            for v in values:
+                self.wb.post_write(addr, v)
+        else:
+            yield self.wb.write_burst(addr, values)
+
+    @cocotb.coroutine
+    def flush(self):
+        """Wait until all posted CSR writes are completed."""
+        yield self.wb.flush()
 
     @cocotb.coroutine
     def read(self, addr):
+        if addr in self.backdoor:
+            yield self.flush()
+            current = self._backdoor_value(addr)
+            if current is not None:
+                raise ReturnValue(get_field(current, self.backdoor[addr][1],
+                                            self.CSR_DATA_WIDTH))
+            self.dut._log.debug("Unresolvable CSR value, reading {:#x} over "
+                                "the bus".format(addr))
         value = yield self.wb.read(addr)
         raise ReturnValue(value)
 
     @cocotb.coroutine
     def connect(self):
-        USB_PULLUP_OUT = self.csrs['usb_pullup_out']
+        USB_PULLUP_OUT = self.csr.usb_pullup_out
         yield self.write(USB_PULLUP_OUT, 1)
+        yield self.flush()
 
     @cocotb.coroutine
     def clear_pending(self, epaddr):
         if EndpointType.epdir(epaddr) == EndpointType.IN:
             # Reset endpoint
             self.dut._log.info("Clearing IN_EV_PENDING")
-            yield self.write(self.csrs['usb_in_ctrl'], 0x20)
-            yield self.write(self.csrs['usb_in_ev_pending'], 0xff)
+            yield self.write(self.csr.usb_in_ctrl,
+                             set_field(0, *self.CTRL_RESET, 1))
+            yield self.write(self.csr.usb_in_ev_pending, 0xff)
         else:
             self.dut._log.info("Clearing OUT_EV_PENDING")
-            yield self.write(self.csrs['usb_out_ev_pending'], 0xff)
-            yield self.write(self.csrs['usb_out_ctrl'], 0x20)
+            yield self.write(self.csr.usb_out_ev_pending, 0xff)
+            yield self.write(self.csr.usb_out_ctrl,
+                             set_field(0, *self.CTRL_RESET, 1))
 
     @cocotb.coroutine
     def disconnect(self):
-        super().disconnect()
-        USB_PULLUP_OUT = self.csrs['usb_pullup_out']
+        yield super().disconnect()
+        USB_PULLUP_OUT = self.csr.usb_pullup_out
         self.address = 0
         yield self.write(USB_PULLUP_OUT, 0)
+        yield self.flush()
 
     @cocotb.coroutine
     def pending(self, ep):
         if EndpointType.epdir(ep) == EndpointType.IN:
-            val = yield self.read(self.csrs['usb_in_status'])
-            raise ReturnValue(val & (1 << 4))
+            val = yield self.read(self.csr.usb_in_status)
+            raise ReturnValue(get_field(val, *self.STATUS_HAVE))
         else:
-            val = yield self.read(self.csrs['usb_out_status'])
+            val = yield self.read(self.csr.usb_out_status)
             raise ReturnValue((val & (1 << 5) | (1 << 4))
-                              and (EndpointType.epnum(ep) == (val & 0x0f)))
+                              and (EndpointType.epnum(ep) ==
+                                   get_field(val, *self.STATUS_EPNO)))
 
     @cocotb.coroutine
-    def expect_setup(self, epaddr, expected_data):
-        actual_data = []
-        # wait for data to appear
-        for i in range(128):
+    def wait_status(self, addr, field):
+        """Wait until bit *field* is set in status register *addr*.
+
+        If an interrupt line is available, waits for its rising edge first
+        and checks the register once. Otherwise, or if the interrupt did not
+        come within a transaction carrying a packet of ``max_packet_size``
+        bytes and a retry interval, the register is polled.
+
+        Returns:
+            int: Last value read from the register.
+        """
+        irq = self.irq
+        if (irq is not None and irq.value.is_resolvable
+                and not irq.value.integer):
+            yield First(RisingEdge(irq), Timer(self.irq_timeout, "us"))
+            status = yield self.read(addr)
+            if get_field(status, *field):
+                raise ReturnValue(status)
+            self.dut._log.debug("No interrupt, polling status")
+        for i in range(self.PRIME_CYCLES):
             self.dut._log.debug("Prime loop {}".format(i))
-            status = yield self.read(self.csrs['usb_setup_status'])
-            have = status & 0x10
-            if have:
+            status = yield self.read(addr)
+            if get_field(status, *field):
                 break
             yield RisingEdge(self.dut.clk12)
+        raise ReturnValue(status)
+
+    @cocotb.coroutine
+    def expect_setup(self, epaddr, expected_data):
+        actual_data = []
+        # wait for data to appear
+        yield self.wait_status(self.csr.usb_setup_status,
+                               self.STATUS_HAVE)
 
         for i in range(48):
             self.dut._log.debug("Read loop {}".format(i))
-            status = yield self.read(self.csrs['usb_setup_status'])
-            have = status & 0x10
+            status = yield self.read(self.csr.usb_setup_status)
+            have = get_field(status, *self.STATUS_HAVE)
             if not have:
                 break
-            v = yield self.read(self.csrs['usb_setup_data'])
+            v = yield self.read(self.csr.usb_setup_data)
             actual_data.append(v)
             yield RisingEdge(self.dut.clk12)
 
@@ -127,58 +305,54 @@ class UsbTestValenty(UsbTest):
         assertEqual(crc16(expected_data), actual_crc16,
                     "CRC16 not valid")
         # Acknowledge that we've handled the setup packet
-        yield self.write(self.csrs['usb_setup_ctrl'], 2)
+        yield self.write(self.csr.usb_setup_ctrl, 2)
 
     @cocotb.coroutine
     def drain_setup(self):
         actual_data = []
         for i in range(48):
-            status = yield self.read(self.csrs['usb_setup_status'])
-            have = status & 0x10
+            status = yield self.read(self.csr.usb_setup_status)
+            have = get_field(status, *self.STATUS_HAVE)
             if not have:
                 break
-            v = yield self.read(self.csrs['usb_setup_data'])
+            v = yield self.read(self.csr.usb_setup_data)
             actual_data.append(v)
             yield RisingEdge(self.dut.clk12)
-        yield self.write(self.csrs['usb_setup_ctrl'], 2)
+        yield self.write(self.csr.usb_setup_ctrl, 2)
         # Drain the pending bit
-        yield self.write(self.csrs['usb_setup_ev_pending'], 0xff)
+        yield self.write(self.csr.usb_setup_ev_pending, 0xff)
         return actual_data
 
     @cocotb.coroutine
     def drain_out(self):
         actual_data = []
         for i in range(70):
-            status = yield self.read(self.csrs['usb_out_status'])
-            have = status & (1 << 4)
+            status = yield self.read(self.csr.usb_out_status)
+            have = get_field(status, *self.STATUS_HAVE)
             if not have:
                 break
-            v = yield self.read(self.csrs['usb_out_data'])
+            v = yield self.read(self.csr.usb_out_data)
             actual_data.append(v)
             yield RisingEdge(self.dut.clk12)
-        yield self.write(self.csrs['usb_out_ev_pending'], 0xff)
-        yield self.write(self.csrs['usb_out_ctrl'], 0x10)
+        yield self.write(self.csr.usb_out_ev_pending, 0xff)
+        yield self.write(self.csr.usb_out_ctrl,
+                         set_field(0, *self.CTRL_ENABLE, 1))
         return actual_data[:-2]  # Strip off CRC16
 
     @cocotb.coroutine
     def expect_data(self, epaddr, expected_data, expected):
         actual_data = []
         # wait for data to appear
-        for i in range(128):
-            self.dut._log.debug("Prime loop {}".format(i))
-            status = yield self.read(self.csrs['usb_out_status'])
-            have = status & (1 << 4)
-            if have:
-                break
-            yield RisingEdge(self.dut.clk12)
+        yield self.wait_status(self.csr.usb_out_status,
+                               self.STATUS_HAVE)
 
         for i in range(256):
             self.dut._log.debug("Read loop {}".format(i))
-            status = yield self.read(self.csrs['usb_out_status'])
-            have = status & (1 << 4)
+            status = yield self.read(self.csr.usb_out_status)
+            have = get_field(status, *self.STATUS_HAVE)
             if not have:
                 break
-            v = yield self.read(self.csrs['usb_out_data'])
+            v = yield self.read(self.csr.usb_out_data)
             actual_data.append(v)
             yield RisingEdge(self.dut.clk12)
 
@@ -193,33 +367,36 @@ class UsbTestValenty(UsbTest):
                         "DATA packet not correctly received")
             assertEqual(crc16(expected_data), actual_crc16,
                         "CRC16 not valid")
-            pending = yield self.read(self.csrs['usb_out_ev_pending'])
+            pending = yield self.read(self.csr.usb_out_ev_pending)
             if pending != 1:
                 raise TestFailure('event not generated')
-            yield self.write(self.csrs['usb_out_ev_pending'], pending)
+            yield self.write(self.csr.usb_out_ev_pending, pending)
+        return actual_data
 
     @cocotb.coroutine
     def set_response(self, ep, response):
         if (EndpointType.epdir(ep) == EndpointType.IN
                 and response == EndpointResponse.ACK):
-            yield self.write(self.csrs['usb_in_ctrl'], EndpointType.epnum(ep))
+            yield self.write(self.csr.usb_in_ctrl, EndpointType.epnum(ep))
         elif (EndpointType.epdir(ep) == EndpointType.OUT
                 and response == EndpointResponse.ACK):
-            yield self.write(self.csrs['usb_out_ctrl'],
-                             0x10 | EndpointType.epnum(ep))
+            yield self.write(self.csr.usb_out_ctrl,
+                             set_field(EndpointType.epnum(ep),
+                                       *self.CTRL_ENABLE, 1))
 
     @cocotb.coroutine
     def send_data(self, token, ep, data):
-        for b in data:
-            yield self.write(self.csrs['usb_in_data'], b)
-        yield self.write(self.csrs['usb_in_ctrl'],
-                         EndpointType.epnum(ep) & 0x0f)
+        yield self.write_burst(self.csr.usb_in_data, data)
+        yield self.write(self.csr.usb_in_ctrl,
+                         set_field(0, *self.CTRL_EPNO,
+                                   EndpointType.epnum(ep)))
 
     @cocotb.coroutine
-    def transaction_setup(self, addr, data, epnum=0):
+    def transaction_setup(self, addr, data, epnum=0, deadline=None):
         epaddr_out = EndpointType.epaddr(0, EndpointType.OUT)
 
-        xmit = cocotb.fork(self.host_setup(addr, epnum, data))
+        # Forked, so the deadline is passed on explicitly
+        xmit = cocotb.fork(self.host_setup(addr, epnum, data, deadline))
         yield self.expect_setup(epaddr_out, data)
         yield xmit.join()
 
@@ -230,26 +407,32 @@ class UsbTestValenty(UsbTest):
                              data,
                              chunk_size=64,
                              expected=PID.ACK,
-                             datax=PID.DATA1):
+                             datax=PID.DATA1,
+                             deadline=None):
         epnum = EndpointType.epnum(ep)
 
         # # Set it up so we ACK the final IN packet
-        # yield self.write(self.csrs['usb_in_ctrl'], 0)
-        for _i, chunk in enumerate(grouper_tofit(chunk_size, data)):
+        # yield self.write(self.csr.usb_in_ctrl, 0)
+        self.out_received = []
+        for _i, chunk in enumerate(out_chunks(data, chunk_size)):
             self.dut._log.warning("Sending {} bytes to host"
                                   .format(len(chunk)))
-            self.packet_deadline = get_sim_time("us") + super().MAX_PACKET_TIME
             # Enable receiving data
             yield self.set_response(ep, EndpointResponse.ACK)
-            xmit = cocotb.fork(
-                self.host_send(datax, addr, epnum, chunk, expected))
-            yield self.expect_data(epnum, list(chunk), expected)
+            yield self.flush()
+            xmit = cocotb.fork(self.deadlines.run(
+                self.host_send(datax, addr, epnum, chunk, expected),
+                self.MAX_PACKET_TIME, "OUT data packet", parent=deadline))
+            received = yield self.expect_data(epnum, list(chunk), expected)
+            if expected == PID.ACK:
+                self.out_received.extend(received)
             yield xmit.join()
 
             if datax == PID.DATA0:
                 datax = PID.DATA1
             else:
                 datax = PID.DATA0
+        raise ReturnValue(datax)
 
     @cocotb.coroutine
     def transaction_data_in(self,
@@ -257,44 +440,101 @@ class UsbTestValenty(UsbTest):
                             ep,
                             data,
                             chunk_size=64,
-                            datax=PID.DATA1):
+                            datax=PID.DATA1,
+                            deadline=None,
+                            fill=None):
+        """Expect *data* from an IN endpoint, loading the IN FIFO on the
+        device side.
+
+        Args:
+            fill (list, optional): Bytes to be loaded into the IN FIFO,
+                *data* by default. Used to send back what the device
+                received, as its firmware would.
+        """
         epnum = EndpointType.epnum(ep)
         sent_data = 0
-        for i, chunk in enumerate(grouper_tofit(chunk_size, data)):
-            # Do we still have time?
-            current = get_sim_time("us")
-            if current > self.request_deadline:
-                raise TestFailure("Failed to get all data in time")
-
+        fills = None
+        if fill is not None:
+            fills = [c for c, _ in in_chunks(list(fill), chunk_size)]
+        # Time without data on the bus, from the end of a data packet to the
+        # first IN token trying to fetch the next one. Time spent retrying
+        # NAKed tokens is kept apart.
+        idle = 0
+        retries = 0
+        done = get_sim_time("us")
+        # FIFO fill time per byte (in us), measured on the previous chunk
+        fill_rate = None
+        for i, (chunk, expected) in enumerate(in_chunks(data, chunk_size)):
             self.dut._log.debug("Expecting chunk {}".format(i))
-            self.packet_deadline = current + 5e2  # 500 ms
+            if fills is not None:
+                chunk = fills[i] if i < len(fills) else []
 
             sent_data = 1
             self.dut._log.debug(
                 "Actual data we're expecting: {}".format(chunk))
-            for b in chunk:
-                yield self.write(self.csrs['usb_in_data'], b)
-            yield self.write(self.csrs['usb_in_ctrl'], epnum)
-            recv = cocotb.fork(self.host_recv(datax, addr, epnum, chunk))
-            yield recv.join()
+            start = get_sim_time("us")
+            # Bytes still to be written once the host starts its IN token
+            # delay, so the data is ready when the device answers the token
+            # instead of NAKing it (costing a whole retry interval)
+            tail = 0
+            if self.pipeline_in and fill_rate:
+                tail = min(len(chunk), int(self.in_fill_time / fill_rate))
+            head = len(chunk) - tail
+            if head:
+                yield self.write_burst(self.csr.usb_in_data, chunk[:head])
+            recv = None
+            if tail:
+                yield self.flush()
+                recv = cocotb.fork(self.deadlines.run(
+                    self.host_recv(datax, addr, epnum, expected),
+                    self.MAX_DATA_PACKET_TIME, "IN data packet",
+                    parent=deadline))
+                yield self.write_burst(self.csr.usb_in_data, chunk[head:])
+            yield self.write(self.csr.usb_in_ctrl, epnum)
+            yield self.flush()
+            if chunk:
+                fill_rate = (get_sim_time("us") - start) / len(chunk)
+            if recv is not None:
+                yield recv.join()
+            else:
+                yield self.deadlines.run(
+                    self.host_recv(datax, addr, epnum, expected),
+                    self.MAX_DATA_PACKET_TIME, "IN data packet",
+                    parent=deadline)
+            idle += self.first_in_token - done
+            retries += self.last_in_token - self.first_in_token
+            done = get_sim_time("us")
 
             if datax == PID.DATA0:
                 datax = PID.DATA1
             else:
                 datax = PID.DATA0
+        if sent_data:
+            self.dut._log.info("IN data: bus idle for {:.2f} us, "
+                               "{:.2f} us in NAK retries"
+                               .format(idle, retries))
         if not sent_data:
-            yield self.write(self.csrs['usb_in_ctrl'], epnum)
-            recv = cocotb.fork(self.host_recv(datax, addr, epnum, []))
-            yield self.send_data(datax, epnum, data)
+            yield self.write(self.csr.usb_in_ctrl, epnum)
+            recv = cocotb.fork(self.deadlines.run(
+                self.host_recv(datax, addr, epnum, []),
+                self.MAX_DATA_PACKET_TIME, "IN data packet",
+                parent=deadline))
+            yield self.send_data(datax, epnum,
+                                 data if fill is None else list(fill))
             yield recv.join()
+            if datax == PID.DATA0:
+                datax = PID.DATA1
+            else:
+                datax = PID.DATA0
+        raise ReturnValue(datax)
 
     @cocotb.coroutine
     def set_data(self, ep, data):
-        for b in data:
-            yield self.write(self.csrs['usb_in_data'], b)
+        yield self.write_burst(self.csr.usb_in_data, data)
 
     @cocotb.coroutine
-    def control_transfer_out(self, addr, setup_data, descriptor_data=None):
+    def control_transfer_out(self, addr, setup_data, descriptor_data=None,
+                             deadline=None):
         epaddr_out = EndpointType.epaddr(0, EndpointType.OUT)
         epaddr_in = EndpointType.epaddr(0, EndpointType.IN)
 
@@ -304,50 +544,57 @@ class UsbTestValenty(UsbTest):
                 "an OUT transfer"
             )
 
-        setup_ev = yield self.read(self.csrs['usb_setup_ev_pending'])
+        setup_ev = yield self.read(self.csr.usb_setup_ev_pending)
 
         # Setup stage
         self.dut._log.info("setup stage")
-        yield self.transaction_setup(addr, setup_data)
-        self.request_deadline = get_sim_time("us") + super().MAX_REQUEST_TIME
-
-        setup_ev = yield self.read(self.csrs['usb_setup_ev_pending'])
-        yield self.write(self.csrs['usb_setup_ev_pending'], setup_ev)
-
-        # Data stage
-        if (setup_data[7] != 0
-                or setup_data[6] != 0) and descriptor_data is None:
-            raise Exception(
-                "setup_data indicates data, but no descriptor data"
-                "was specified"
-            )
-        if (setup_data[7] == 0
-                and setup_data[6] == 0) and descriptor_data is not None:
-            raise Exception(
-                "setup_data indicates no data, but descriptor data"
-                "was specified"
-            )
-        if descriptor_data is not None:
-            self.dut._log.info("data stage")
-            yield self.transaction_data_out(addr, epaddr_out, descriptor_data)
-
-        # Status stage
-        self.dut._log.info("status stage")
-        self.packet_deadline = get_sim_time("us") + super().MAX_PACKET_TIME
-        yield self.write(self.csrs['usb_in_ctrl'], 0)  # Send empty IN packet
-        yield self.transaction_status_in(addr, epaddr_in)
-        yield RisingEdge(self.dut.clk12)
-        yield RisingEdge(self.dut.clk12)
-        in_ev = yield self.read(self.csrs['usb_in_ev_pending'])
-        yield self.write(self.csrs['usb_in_ev_pending'], in_ev)
-        yield self.write(self.csrs['usb_in_ctrl'], 1 << 5)  # Reset IN buffer
-
-        # Was the time limit honored?
-        if get_sim_time("us") > self.request_deadline:
-            raise TestFailure("Failed to process the OUT request in time")
+        yield self.transaction_setup(addr, setup_data, deadline=deadline)
+        request = self.deadlines.open(self.MAX_REQUEST_TIME, "OUT request",
+                                      parent=deadline)
+        try:
+            setup_ev = yield self.read(self.csr.usb_setup_ev_pending)
+            yield self.write(self.csr.usb_setup_ev_pending, setup_ev)
+
+            # Data stage
+            if (setup_data[7] != 0
+                    or setup_data[6] != 0) and descriptor_data is None:
+                raise Exception(
+                    "setup_data indicates data, but no descriptor data"
+                    "was specified"
+                )
+            if (setup_data[7] == 0
+                    and setup_data[6] == 0) and descriptor_data is not None:
+                raise Exception(
+                    "setup_data indicates no data, but descriptor data"
+                    "was specified"
+                )
+            if descriptor_data is not None:
+                self.dut._log.info("data stage")
+                yield self.transaction_data_out(addr, epaddr_out,
+                                                descriptor_data,
+                                                deadline=request)
+
+            # Status stage
+            self.dut._log.info("status stage")
+            # Send empty IN packet
+            yield self.write(self.csr.usb_in_ctrl, 0)
+            yield self.flush()
+            yield self.deadlines.run(
+                self.transaction_status_in(addr, epaddr_in),
+                self.MAX_PACKET_TIME, "status stage", parent=request)
+            yield RisingEdge(self.dut.clk12)
+            yield RisingEdge(self.dut.clk12)
+            in_ev = yield self.read(self.csr.usb_in_ev_pending)
+            yield self.write(self.csr.usb_in_ev_pending, in_ev)
+            # Reset IN buffer
+            yield self.write(self.csr.usb_in_ctrl,
+                             set_field(0, *self.CTRL_RESET, 1))
+        finally:
+            self.deadlines.close(request)
 
     @cocotb.coroutine
-    def control_transfer_in(self, addr, setup_data, descriptor_data=None):
+    def control_transfer_in(self, addr, setup_data, descriptor_data=None,
+                            deadline=None):
         epaddr_out = EndpointType.epaddr(0, EndpointType.OUT)
         epaddr_in = EndpointType.epaddr(0, EndpointType.IN)
 
@@ -357,57 +604,64 @@ class UsbTestValenty(UsbTest):
                 "an IN transfer"
             )
 
-        setup_ev = yield self.read(self.csrs['usb_setup_ev_pending'])
+        setup_ev = yield self.read(self.csr.usb_setup_ev_pending)
 
         # Setup stage
         self.dut._log.info("setup stage")
-        yield self.transaction_setup(addr, setup_data)
-        self.request_deadline = get_sim_time("us") + super().MAX_REQUEST_TIME
-
-        setup_ev = yield self.read(self.csrs['usb_setup_ev_pending'])
-        yield self.write(self.csrs['usb_setup_ev_pending'], setup_ev)
-
-        # Data stage
-        in_ev = yield self.read(self.csrs['usb_in_ev_pending'])
-        if (setup_data[7] != 0
-                or setup_data[6] != 0) and descriptor_data is None:
-            raise Exception(
-                "setup_data indicates data, but no descriptor data"
-                "was specified"
-            )
-        if (setup_data[7] == 0
-                and setup_data[6] == 0) and descriptor_data is not None:
-            raise Exception(
-                "setup_data indicates no data, but descriptor data"
-                "was specified"
-            )
-        if descriptor_data is not None:
-            self.dut._log.info("data stage")
-            yield self.transaction_data_in(addr, epaddr_in, descriptor_data)
-
-            # Give the signal two clock cycles
-            # to percolate through the event manager
-            yield RisingEdge(self.dut.clk12)
+        yield self.transaction_setup(addr, setup_data, deadline=deadline)
+        request = self.deadlines.open(self.MAX_REQUEST_TIME, "IN request",
+                                      parent=deadline)
+        try:
+            setup_ev = yield self.read(self.csr.usb_setup_ev_pending)
+            yield self.write(self.csr.usb_setup_ev_pending, setup_ev)
+
+            # Data stage
+            in_ev = yield self.read(self.csr.usb_in_ev_pending)
+            if (setup_data[7] != 0
+                    or setup_data[6] != 0) and descriptor_data is None:
+                raise Exception(
+                    "setup_data indicates data, but no descriptor data"
+                    "was specified"
+                )
+            if (setup_data[7] == 0
+                    and setup_data[6] == 0) and descriptor_data is not None:
+                raise Exception(
+                    "setup_data indicates no data, but descriptor data"
+                    "was specified"
+                )
+            if descriptor_data is not None:
+                self.dut._log.info("data stage")
+                yield self.transaction_data_in(addr, epaddr_in,
+                                               descriptor_data,
+                                               deadline=request)
+
+                # Give the signal two clock cycles
+                # to percolate through the event manager
+                yield RisingEdge(self.dut.clk12)
+                yield RisingEdge(self.dut.clk12)
+                in_ev = yield self.read(self.csr.usb_in_ev_pending)
+                yield self.write(self.csr.usb_in_ev_pending, in_ev)
+
+            # Status stage
+            # Send empty packet
+            yield self.write(self.csr.usb_out_ctrl,
+                             set_field(0, *self.CTRL_ENABLE, 1))
+            self.dut._log.info("status stage")
+            out_ev = yield self.read(self.csr.usb_out_ev_pending)
+            yield self.deadlines.run(
+                self.transaction_status_out(addr, epaddr_out),
+                self.MAX_PACKET_TIME, "status stage", parent=request)
             yield RisingEdge(self.dut.clk12)
-            in_ev = yield self.read(self.csrs['usb_in_ev_pending'])
-            yield self.write(self.csrs['usb_in_ev_pending'], in_ev)
-
-        # Status stage
-        self.packet_deadline = get_sim_time("us") + super().MAX_PACKET_TIME
-        yield self.write(self.csrs['usb_out_ctrl'], 0x10)  # Send empty packet
-        self.dut._log.info("status stage")
-        out_ev = yield self.read(self.csrs['usb_out_ev_pending'])
-        yield self.transaction_status_out(addr, epaddr_out)
-        yield RisingEdge(self.dut.clk12)
-        out_ev = yield self.read(self.csrs['usb_out_ev_pending'])
-        yield self.write(self.csrs['usb_out_ctrl'], 0x20)  # Reset FIFO
-        yield self.write(self.csrs['usb_out_ev_pending'], out_ev)
-
-        # Was the time limit honored?
-        if get_sim_time("us") > self.request_deadline:
-            raise TestFailure("Failed to process the IN request in time")
+            out_ev = yield self.read(self.csr.usb_out_ev_pending)
+            yield self.write(self.csr.usb_out_ctrl,
+                             set_field(0, *self.CTRL_RESET, 1))
+            yield self.write(self.csr.usb_out_ev_pending, out_ev)
+        finally:
+            self.deadlines.close(request)
 
     @cocotb.coroutine
-    def set_device_address(self, address):
-        yield super().set_device_address(address)
-        yield self.write(self.csrs['usb_address'], address)
+    def set_device_address(self, address, skip_recovery=False,
+                           deadline=None):
+        yield super().set_device_address(address, skip_recovery, deadline)
+        yield self.write(self.csr.usb_address, address)
+        yield self.flush()
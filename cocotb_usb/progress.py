@@ -0,0 +1,123 @@
+import time
+from os import environ
+
+import cocotb
+from cocotb.triggers import Timer
+from cocotb.utils import get_sim_time
+
+
+class ProgressReporter:
+    """Periodic report of simulation progress.
+
+    A single reporter is shared by all harness objects, see
+    ``get_reporter()``. It logs current simulation time along with the ratio
+    of simulated time to wall-clock time, so long waits (i.e. bus reset) can
+    be told apart from a hung simulation.
+
+    Args:
+        log: Logger to be used.
+        interval (float, optional): Report interval in simulated us.
+    """
+    DEFAULT_INTERVAL = 1e3
+
+    def __init__(self, log, interval=DEFAULT_INTERVAL):
+        self.log = log
+        self.interval = interval
+        self.enabled = True
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task._finished
+
+    def start(self):
+        """Fork the reporting coroutine unless it is already running.
+
+        The reporter is shared by all tests of a session while its
+        coroutine only lives until the end of the test that forked it, so
+        each harness object calls this again.
+        """
+        if not self.enabled or self.running:
+            return
+        self._task = cocotb.fork(self._report())
+
+    def stop(self):
+        """Stop reporting until next ``start()``."""
+        if self.running:
+            self._task.kill()
+        self._task = None
+
+    @cocotb.coroutine
+    def _report(self):
+        period = Timer(self.interval, units="us")
+        last_sim = get_sim_time("us")
+        last_wall = time.time()
+        while True:
+            yield period
+            sim = get_sim_time("us")
+            wall = time.time()
+            ratio = (sim - last_sim) / max(wall - last_wall, 1e-9)
+            self.log.info("Simulation time {:.0f} us, {:.1f} us/s"
+                          .format(sim, ratio))
+            last_sim = sim
+            last_wall = wall
+
+
+_reporter = None
+
+
+def _env_heartbeat(log):
+    """Return heartbeat set by ``USB_HEARTBEAT`` environment variable.
+
+    .. doctest::
+
+        >>> import logging
+        >>> environ["USB_HEARTBEAT"] = "off"
+        >>> _env_heartbeat(logging.getLogger())
+        0.0
+        >>> environ["USB_HEARTBEAT"] = "often"
+        >>> _env_heartbeat(logging.getLogger())
+        1000.0
+        >>> del environ["USB_HEARTBEAT"]
+    """
+    value = environ.get("USB_HEARTBEAT")
+    if value is None:
+        return ProgressReporter.DEFAULT_INTERVAL
+    if value.strip().lower() in ("off", "no", "false"):
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        log.warning("Invalid USB_HEARTBEAT value '{}', using {:.0f} us"
+                    .format(value, ProgressReporter.DEFAULT_INTERVAL))
+        return ProgressReporter.DEFAULT_INTERVAL
+
+
+def get_reporter(log, heartbeat=None):
+    """Return the session-wide progress reporter, starting it if enabled.
+
+    Args:
+        log: Logger used when the reporter is created.
+        heartbeat (bool or float, optional): ``False`` disables reports,
+            a number sets the interval in simulated us. If ``None``,
+            ``USB_HEARTBEAT`` environment variable is used the same way
+            (``0`` or ``off`` disables reports), falling back to the default
+            interval. Settings of a previous test are never inherited.
+    """
+    global _reporter
+    if _reporter is None:
+        _reporter = ProgressReporter(log)
+    if heartbeat is None:
+        heartbeat = _env_heartbeat(log)
+    if heartbeat is True:
+        heartbeat = ProgressReporter.DEFAULT_INTERVAL
+    if heartbeat is False or heartbeat == 0:
+        _reporter.enabled = False
+        _reporter.stop()
+    else:
+        _reporter.enabled = True
+        if heartbeat != _reporter.interval:
+            _reporter.interval = heartbeat
+            _reporter.stop()
+        _reporter.start()
+    return _reporter
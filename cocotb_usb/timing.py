@@ -0,0 +1,65 @@
+from collections import namedtuple
+from os import environ
+
+from cocotb_usb.utils import record_properties
+
+TimingProfile = namedtuple("TimingProfile", ["name",
+                                             "reset_time",
+                                             "reset_recovery",
+                                             "address_recovery"])
+TimingProfile.__doc__ = """Bus timing used by the host (all values in us).
+
+    Args:
+        name (str): Profile name, reported in test results.
+        reset_time (float): Duration of SE0 sent by ``port_reset()``.
+        reset_recovery (float): Wait after a reset with ``recover=True``.
+        address_recovery (float): Wait after SET_ADDRESS status stage.
+"""
+
+PROFILES = {
+    # Nominal values from USB specification (sections 7.1.7.5, 9.2.6.3)
+    "spec": TimingProfile("spec", 10e3, 10e3, 2e3),
+    # Long enough for a device to tell reset from a missing keep-alive
+    "fast": TimingProfile("fast", 1e3, 1e2, 1e2),
+    # Just above the 2.5 us SE0 a device needs to detect reset
+    "minimal": TimingProfile("minimal", 1e1, 0, 0),
+}
+
+DEFAULT_PROFILE = "spec"
+
+
+def get_profile(profile=None):
+    """Return timing profile selected by name.
+
+    If *profile* is ``None``, the ``USB_TIMING`` environment variable is
+    used, falling back to the ``spec`` profile.
+
+    Args:
+        profile (str or TimingProfile, optional): Profile name or a custom
+            profile.
+
+    .. doctest::
+
+        >>> get_profile("fast").reset_time
+        1000.0
+        >>> get_profile(TimingProfile("custom", 20, 0, 0)).name
+        'custom'
+        >>> get_profile("slow")
+        Traceback (most recent call last):
+        ...
+        ValueError: Unknown timing profile 'slow', expected one of: spec, fast, minimal
+    """ # noqa
+    if isinstance(profile, TimingProfile):
+        return profile
+    if profile is None:
+        profile = environ.get("USB_TIMING", DEFAULT_PROFILE)
+    try:
+        return PROFILES[profile]
+    except KeyError:
+        raise ValueError("Unknown timing profile '{}', expected one of: {}"
+                         .format(profile, ", ".join(PROFILES)))
+
+
+def record_profile(profile, test_name):
+    """Store timing profile values as properties in the test results."""
+    record_properties(test_name, "timing", profile._asdict())
@@ -13,6 +13,19 @@ class EndpointType(IntEnum):
         assert ep_dir != cls.BIDIR
         return ep_num << 1 | (ep_dir == cls.IN)
 
+    @classmethod
+    def from_descriptor(cls, bEndpointAddress):
+        """Convert ``bEndpointAddress`` of an endpoint descriptor (direction
+        in bit 7) to the address used by the harness.
+
+        >>> EndpointType.from_descriptor(0x81)
+        3
+        >>> EndpointType.from_descriptor(0x02)
+        4
+        """
+        ep_dir = cls.IN if bEndpointAddress & 0x80 else cls.OUT
+        return cls.epaddr(bEndpointAddress & 0x0F, ep_dir)
+
     @classmethod
     def epnum(cls, ep_addr):
         return ep_addr >> 1
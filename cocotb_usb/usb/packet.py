@@ -290,6 +290,42 @@ def sof_packet(frame):
     return encode_pid(PID.SOF) + encode_data(data)
 
 
+# Full-speed bit time in us
+BIT_TIME = 1 / 12
+# Longest gap before a packet answering another one, in bit times (USB 2.0
+# section 7.1.18.1)
+TURNAROUND_BITS = 18
+
+
+def packet_bits(size):
+    """Return worst-case bit times of a packet with *size* bytes following
+    the PID, including SYNC, bit stuffing and EOP.
+
+    >>> packet_bits(0)  # Handshake
+    21
+    >>> packet_bits(2)  # Token
+    40
+    >>> packet_bits(8 + 2)  # DATA0 of a SETUP transaction
+    115
+    """
+    bits = 8 + 8 + 8 * size
+    return bits + bits // 6 + 3
+
+
+def transaction_time(size):
+    """Return worst-case duration (in us) of a transaction carrying a data
+    packet of *size* bytes: token, data, handshake and two turnarounds.
+
+    >>> round(transaction_time(8), 1)
+    17.7
+    >>> round(transaction_time(64), 1)
+    61.2
+    """
+    bits = (packet_bits(2) + packet_bits(size + 2) + packet_bits(0) +
+            2 * TURNAROUND_BITS)
+    return bits * BIT_TIME
+
+
 def diff(value):
     """Convert J/K encoding into bits for P/N diff pair.
 
@@ -324,6 +360,39 @@ def diff(value):
     return usbp, usbn
 
 
+def line_runs(value):
+    """Convert J/K encoding into runs of (d_p, d_n, cycles) line states.
+
+    Consecutive samples driving the same levels are merged, so the result
+    can be replayed with a single assignment per run.
+
+    >>> line_runs('JJKKK__J')
+    [(1, 0, 2), (0, 1, 3), (0, 0, 2), (1, 0, 1)]
+    >>> line_runs('II-J')
+    [(1, 0, 4)]
+    """
+    levels = {
+        '_': (0, 0),
+        '0': (0, 0),
+        '1': (1, 1),
+        'J': (1, 0),
+        'I': (1, 0),
+        '-': (1, 0),
+        'K': (0, 1),
+    }
+    runs = []
+    for v in value:
+        if v == ' ':
+            continue
+        assert v in levels, "Unknown value: %s" % v
+        p, n = levels[v]
+        if runs and runs[-1][:2] == (p, n):
+            runs[-1] = (p, n, runs[-1][2] + 1)
+        else:
+            runs.append((p, n, 1))
+    return runs
+
+
 def undiff(usbp, usbn):
     """Convert P/N diff pair bits into J/K encoding.
 
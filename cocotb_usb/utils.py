@@ -1,4 +1,9 @@
 import csv
+import os
+from collections import namedtuple
+from types import MappingProxyType
+
+import cocotb
 from cocotb.result import TestFailure
 
 
@@ -22,15 +27,158 @@ def grouper_tofit(n, iterable):
     return fixed
 
 
-def parse_csr(csr_file="csr.csv"):
-    csrs = dict()
-    with open(csr_file, newline='') as csr_csv_file:
-        csr_csv = csv.reader(csr_csv_file)
+CsrRegister = namedtuple("CsrRegister", ["name", "address", "size", "mode"])
+CsrRegister.__doc__ = """CSR register as described in ``csr.csv``.
+
+    Args:
+        name (str): Register name.
+        address (int): Bus address.
+        size (int): Size in CSR words.
+        mode (str): ``rw`` or ``ro``.
+"""
+
+
+class CsrAddresses:
+    """Read-only namespace of register addresses, see ``CsrMap.addr``.
+
+    Addresses are stored as plain instance attributes, so looking them up
+    costs no more than any other attribute.
+    """
+    def __init__(self, addresses):
+        vars(self).update(addresses)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CSR map is read-only")
+
+    __delattr__ = __setattr__
+
+
+class CsrMap(dict):
+    """Read-only name to address mapping of CSR registers.
+
+    Registers are also available as attributes of ``addr``, along with
+    their size and access mode in ``registers``. Maps are shared by all
+    harness objects using the same file, so they cannot be modified.
+
+    .. doctest::
+
+        >>> csrs = CsrMap.from_rows([
+        ...     ["csr_base", "usb", "0x82004800", "", ""],
+        ...     ["csr_register", "usb_pullup_out", "0x82004800", "1", "rw"],
+        ...     ["csr_register", "usb_in_status", "0x82004804", "1", "ro"]])
+        >>> csrs['usb_pullup_out'] == csrs.addr.usb_pullup_out == 0x82004800
+        True
+        >>> csrs.registers['usb_in_status'].mode
+        'ro'
+        >>> csrs.check_write(csrs.addr.usb_in_status)
+        Traceback (most recent call last):
+        ...
+        ValueError: CSR usb_in_status is read-only
+        >>> csrs.addr.usb_in_status = 0
+        Traceback (most recent call last):
+        ...
+        AttributeError: CSR map is read-only
+        >>> csrs['usb_in_status'] = 0
+        Traceback (most recent call last):
+        ...
+        TypeError: CSR map is read-only
+    """
+    def __init__(self, registers=()):
+        by_name = {reg.name: reg for reg in registers}
+        super().__init__((name, reg.address)
+                         for name, reg in by_name.items())
+        self._by_address = {reg.address: reg for reg in by_name.values()}
+        self.registers = MappingProxyType(by_name)
+        self.readonly = frozenset(reg.address for reg in by_name.values()
+                                  if reg.mode == "ro")
+        self.addr = CsrAddresses(self)
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("CSR map is read-only")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (self.__class__, (tuple(self.registers.values()),))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build map from rows of ``csr.csv``."""
         # csr_register format: csr_register, name, address, size, rw/ro
-        for row in csr_csv:
-            if row[0] == 'csr_register':
-                csrs[row[1]] = int(row[2], base=0)
-    return csrs
+        return cls(CsrRegister(row[1], int(row[2], base=0),
+                               int(row[3] or 1), row[4])
+                   for row in rows if row[0] == 'csr_register')
+
+    def name_of(self, address):
+        """Return name of the register at *address*, or ``None``."""
+        reg = self._by_address.get(address)
+        return reg.name if reg is not None else None
+
+    def check_write(self, address):
+        """Raise ``ValueError`` if register at *address* is read-only."""
+        if address in self.readonly:
+            raise ValueError("CSR {} is read-only".format(
+                self.name_of(address)))
+
+
+def get_field(value, offset, width=1):
+    """Extract a bit field from a register value.
+
+    .. doctest::
+
+        >>> get_field(0x35, 4)
+        1
+        >>> get_field(0x35, 0, 4)
+        5
+    """
+    return (value >> offset) & ((1 << width) - 1)
+
+
+def set_field(value, offset, width, field):
+    """Return register value with a bit field replaced.
+
+    .. doctest::
+
+        >>> hex(set_field(0x35, 0, 4, 0xa))
+        '0x3a'
+    """
+    mask = ((1 << width) - 1) << offset
+    return (value & ~mask) | ((field << offset) & mask)
+
+
+_csr_cache = {}
+
+
+def parse_csr(csr_file="csr.csv"):
+    """Return CSR map parsed from a LiteX ``csr.csv`` file.
+
+    Parsed files are cached until they are modified.
+    """
+    path = os.path.abspath(csr_file)
+    key = (path, os.stat(path).st_mtime)
+    if key not in _csr_cache:
+        with open(path, newline='') as csr_csv_file:
+            _csr_cache[key] = CsrMap.from_rows(csv.reader(csr_csv_file))
+    return _csr_cache[key]
+
+
+def record_properties(test_name, group, values):
+    """Store *values* as ``<test_name>.<group>.<key>`` properties in the
+    xunit test results, if they are being written.
+
+    Args:
+        test_name (str): Name of the running test.
+        group (str): Name of the feature the values belong to.
+        values (dict): Property values, stored as strings.
+    """
+    manager = cocotb.regression_manager
+    if manager is None or not hasattr(manager, "xunit"):
+        return
+    for key, value in values.items():
+        manager.xunit.add_property(name="{}.{}.{}".format(test_name, group,
+                                                          key),
+                                   value=str(value))
 
 
 def assertEqual(a, b, msg):
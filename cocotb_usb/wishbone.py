@@ -1,9 +1,13 @@
+import json
+from collections import Counter, deque
+
 import cocotb
 from cocotb.decorators import coroutine
 from cocotb.triggers import RisingEdge, Event
 from cocotb.drivers import BusDriver
 from cocotb.result import ReturnValue, TestFailure
 from cocotb.decorators import public
+from cocotb.utils import get_sim_time
 
 
 def is_sequence(arg):
@@ -17,19 +21,38 @@ class WBAux():
 
     wrap meta informations on bus transaction (internal only)
     """
+    __slots__ = ("sel", "adr", "datwr", "waitIdle", "waitStall", "ts",
+                 "tsAccept", "we")
+
     def __init__(self,
                  sel=0xf,
                  adr=0,
                  datwr=None,
                  waitStall=0,
                  waitIdle=0,
-                 tsStb=0):
+                 tsStb=0,
+                 we=0):
         self.sel = sel
         self.adr = adr
         self.datwr = datwr
         self.waitIdle = waitIdle
         self.waitStall = waitStall
         self.ts = tsStb
+        self.tsAccept = tsStb
+        self.we = we
+
+    def result(self, ack, datrd, now):
+        """Return ``WBRes`` of this request, replied to at time *now*"""
+        return WBRes(ack=ack,
+                     sel=self.sel,
+                     adr=self.adr,
+                     datrd=datrd,
+                     datwr=self.datwr,
+                     waitIdle=self.waitIdle,
+                     waitStall=self.waitStall,
+                     waitAck=now - self.tsAccept,
+                     latency=now - self.ts,
+                     we=self.we)
 
 
 @public
@@ -39,20 +62,33 @@ class WBOp():
 
     an attempt to wrap em tidy
     """
+    __slots__ = ("adr", "dat", "sel", "idle")
+
     def __init__(self, adr=0, dat=None, idle=0, sel=0xf):
         self.adr = adr
         self.dat = dat
         self.sel = sel
         self.idle = idle
 
+    @property
+    def we(self):
+        """Write enable to be driven, ``1`` for writes"""
+        return int(self.dat is not None)
+
 
 @public
 class WBRes():
     """
     Wishbone Result Wrapper Class.
 
-    What's happend on the bus plus meta information on timing
+    What's happend on the bus plus meta information on timing.
+    ``waitAck`` counts clock cycles from the request being accepted to its
+    acknowledge, ``latency`` counts them from the strobe, including stalls.
+    ``we`` tells writes from reads, ``datwr`` is ``None`` for reads.
     """
+    __slots__ = ("ack", "sel", "adr", "datrd", "datwr", "waitStall",
+                 "waitAck", "waitIdle", "latency", "we")
+
     def __init__(self,
                  ack=0,
                  sel=0xf,
@@ -61,7 +97,9 @@ class WBRes():
                  datwr=None,
                  waitIdle=0,
                  waitStall=0,
-                 waitAck=0):
+                 waitAck=0,
+                 latency=0,
+                 we=0):
         self.ack = ack
         self.sel = sel
         self.adr = adr
@@ -70,6 +108,97 @@ class WBRes():
         self.waitStall = waitStall
         self.waitAck = waitAck
         self.waitIdle = waitIdle
+        self.latency = latency
+        self.we = we
+
+
+class WBStats():
+    """
+    Wishbone Statistics Collector
+
+    Accumulates results of bus cycles: operation counts per address, reply
+    totals, histograms of wait times (in clock cycles) and bus utilisation.
+
+    Requests are classified by write enable, results built by hand need
+    ``we=1`` for writes.
+
+    .. doctest::
+
+        >>> stats = WBStats()
+        >>> ops = [WBOp(0x10, 1), WBOp(0x10), WBOp(0x11)]
+        >>> requests = [WBAux(op.sel, op.adr, op.dat, tsStb=0, we=op.we)
+        ...             for op in ops]
+        >>> stats.record([r.result(1, 0, 2) for r in requests],
+        ...              start=0, end=40)
+        >>> stats.to_dict()["replies"], stats.to_dict()["waitAck"]
+        ({'ack': 3}, {'2': 3})
+        >>> stats.to_dict()["addresses"]["0x00000040"]
+        {'read': 1, 'write': 1}
+        >>> stats.to_dict()["addresses"]["0x00000044"]
+        {'read': 1, 'write': 0}
+    """
+    replyTypes = {1: "ack", 2: "err", 3: "rty"}
+    histograms = ("waitAck", "waitStall", "waitIdle", "latency")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.cycles = 0
+        self.reads = Counter()
+        self.writes = Counter()
+        self.replies = Counter()
+        self.hist = {name: Counter() for name in self.histograms}
+        self.busy_time = 0
+        self.first = None
+        self.last = None
+
+    def record(self, results, start, end):
+        """Add results of a bus cycle open from *start* to *end*
+        (simulation steps)"""
+        self.cycles += 1
+        for res in results:
+            if res.we:
+                self.writes[res.adr] += 1
+            else:
+                self.reads[res.adr] += 1
+            self.replies[self.replyTypes.get(res.ack, str(res.ack))] += 1
+            for name in self.histograms:
+                value = getattr(res, name)
+                if value is not None:
+                    self.hist[name][value] += 1
+        self.busy_time += end - start
+        if self.first is None:
+            self.first = start
+        self.last = end
+
+    @property
+    def utilisation(self):
+        """Fraction of simulation time with a bus cycle open"""
+        if self.first is None or self.last == self.first:
+            return 0.0
+        return self.busy_time / (self.last - self.first)
+
+    def to_dict(self):
+        addresses = {}
+        for adr in sorted(set(self.reads) | set(self.writes)):
+            addresses["0x%08x" % (adr << 2)] = {"read": self.reads[adr],
+                                                "write": self.writes[adr]}
+        result = {
+            "cycles": self.cycles,
+            "operations": sum(self.reads.values()) + sum(self.writes.values()),
+            "utilisation": self.utilisation,
+            "replies": dict(self.replies),
+            "addresses": addresses,
+        }
+        for name, hist in self.hist.items():
+            result[name] = {str(k): hist[k] for k in sorted(hist)}
+        return result
+
+    def dump(self, path):
+        """Write statistics to a JSON file"""
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
 
 
 class Wishbone(BusDriver):
@@ -97,77 +226,126 @@ class Wishbone(BusDriver):
 class WishboneMaster(Wishbone):
     """
     Wishbone master
+
+    Slave replies are sampled by a single long-lived monitor coroutine,
+    which sleeps while no cycle is open. Wait times are derived from
+    simulation timestamps taken at strobe and at acknowledge.
+
+    In pipelined mode (Wishbone B4) a new request is issued as soon as the
+    previous one is accepted, without waiting for its acknowledge. Replies
+    are matched to outstanding requests in order.
+
+    Args:
+        timeout (int, optional): Cycle timeout in clock cycles.
+        width (int, optional): Data bus width.
+        pipeline (int or bool, optional): Enable pipelined mode. An integer
+            limits the number of requests waiting for acknowledge, ``True``
+            leaves it unlimited. If ``None``, pipelined mode with unlimited
+            window is used when the bus has a ``stall`` signal.
+        stats (bool, optional): Collect bus statistics in ``stats``
+            (see ``WBStats``).
     """
-    def __init__(self, entity, name, clock, timeout=None, width=32):
+    def __init__(self, entity, name, clock, timeout=None, width=32,
+                 pipeline=None, stats=False):
         sTo = ", no cycle timeout"
         if timeout is not None:
             sTo = ", cycle timeout is %u clock cycles" % timeout
         self.busy_event = Event("%s_busy" % name)
+        self._cycle_event = Event("%s_cycle" % name)
+        self._ack_event = Event("%s_ack" % name)
+        self._monitor_task = None
         self._timeout = timeout
+        self._timed_out = False
         self.busy = False
         self._acked_ops = 0
+        self._driven_ops = 0
         self._res_buf = []
-        self._aux_buf = []
+        self._pending = deque()
         self._op_cnt = 0
-        self._clk_cycle_count = 0
+        self._clk_period = None
+        self._cycle_start = 0
+        self.stats = WBStats() if stats else None
+        # Posted writes
+        self._write_queue = []
+        self._writer_task = None
+        self._write_posted = Event("%s_write_posted" % name)
+        self._writes_done = Event("%s_writes_done" % name)
+        self._writes_done.set()
         Wishbone.__init__(self, entity, name, clock, width)
+        if pipeline is None:
+            pipeline = hasattr(self.bus, "stall")
+        self.pipelined = pipeline is not False
+        self.window = None
+        if pipeline is not True and pipeline is not False:
+            if pipeline < 1:
+                raise ValueError("Pipeline window must be at least 1")
+            self.window = pipeline
+        if self.pipelined:
+            sTo += ", pipelined"
+            if self.window is not None:
+                sTo += " with window of %u requests" % self.window
         self.log.info("Wishbone Master created%s" % sTo)
 
-    @coroutine
-    def _clk_cycle_counter(self):
-        """
-        Cycle counter to time bus operations
-        """
-        clkedge = RisingEdge(self.clock)
-        self._clk_cycle_count = 0
-        while self.busy:
-            yield clkedge
-            self._clk_cycle_count += 1
+    def _cycles(self, steps):
+        """Convert a simulation time difference into clock cycles"""
+        if not self._clk_period:
+            return 0
+        return int(round(steps / self._clk_period))
 
     @coroutine
-    def _open_cycle(self):
-        # Open new wishbone cycle
-        if self.busy:
-            self.log.error(
-                "Opening Cycle, but WB Driver is already busy."
-            )
+    def _open_cycle(self, count):
+        # Open new wishbone cycle of count operations. Posted writes and
+        # foreground accesses may both wait here, so check again after
+        # every wake-up
+        while self.busy:
+            self.log.debug("Opening Cycle, waiting for WB Driver")
             yield self.busy_event.wait()
         self.busy_event.clear()
-        self.busy = True
-        cocotb.fork(self._read())
-        cocotb.fork(self._clk_cycle_counter())
-        self.bus.cyc <= 1
+        # Only set once the bus is ours, the count of the open cycle is
+        # still needed by _close_cycle()
+        self._op_cnt = count
         self._acked_ops = 0
+        self._driven_ops = 0
+        self._timed_out = False
         self._res_buf = []
-        self._aux_buf = []
+        self._pending.clear()
+        self._cycle_start = get_sim_time()
+        self.busy = True
+        # A master kept from an earlier test has lost its monitor, fork it
+        # again for this cycle
+        if self._monitor_task is None or self._monitor_task._finished:
+            self._monitor_task = cocotb.fork(self._monitor())
+        self._cycle_event.set()
+        self.bus.cyc <= 1
         self.log.debug("Opening cycle, %u Ops" % self._op_cnt)
 
+    @coroutine
+    def _wait_replies(self, count):
+        """Wait until *count* operations of the cycle are acknowledged"""
+        while self._acked_ops < count:
+            if self._timed_out:
+                raise TestFailure(
+                    "Timeout of %u clock cycles reached when waiting for"
+                    "reply from slave"
+                    % self._timeout)
+            self._ack_event.clear()
+            yield self._ack_event.wait()
+
     @coroutine
     def _close_cycle(self):
         # Close current wishbone cycle
         clkedge = RisingEdge(self.clock)
-        count = 0
-        last_acked_ops = 0
         # Wait for all Operations being acknowledged by the slave
         # before lowering the cycle line. This is not mandatory by the bus
         # standard, but a crossbar might send acks to the wrong master if we
         # don't wait. We don't want to risk that, it could hang the bus
-        while self._acked_ops < self._op_cnt:
-            if last_acked_ops != self._acked_ops:
-                self.log.debug("Waiting for missing acks: %u/%u" %
-                               (self._acked_ops, self._op_cnt))
-            last_acked_ops = self._acked_ops
-            # check for timeout when finishing the cycle
-            count += 1
-            if (not (self._timeout is None)):
-                if (count > self._timeout):
-                    raise TestFailure(
-                        "Timeout of %u clock cycles reached when waiting for"
-                        "reply from slave"
-                        % self._timeout)
-            yield clkedge
+        if self._acked_ops < self._op_cnt:
+            self.log.debug("Waiting for missing acks: %u/%u" %
+                           (self._acked_ops, self._op_cnt))
+        yield self._wait_replies(self._op_cnt)
 
         self.busy = False
+        self._cycle_event.clear()
         self.busy_event.set()
         self.bus.cyc <= 0
         yield clkedge
@@ -198,14 +376,12 @@ class WishboneMaster(Wishbone):
         """
         # wait for acknownledgement before continuing
         # Classic Wishbone without pipelining
-        clkedge = RisingEdge(self.clock)
-        count = 0
-        if not hasattr(self.bus, "stall"):
-            while not self._get_reply():
-                yield clkedge
-                count += 1
-            self.log.debug("Waited %u cycles for acknowledge" % count)
-        raise ReturnValue(count)
+        if not self.pipelined:
+            yield self._wait_replies(self._driven_ops)
+        elif self.window is not None:
+            # Keep at most window requests outstanding, the next one
+            # included
+            yield self._wait_replies(self._driven_ops - self.window + 1)
 
     def _get_reply(self):
         # helper function for slave acks
@@ -227,30 +403,46 @@ class WishboneMaster(Wishbone):
         return (tmpAck + 2 * tmpErr + 3 * tmpRty)
 
     @coroutine
-    def _read(self):
+    def _monitor(self):
         """
         Reader for slave replies
         """
-        count = 0
         clkedge = RisingEdge(self.clock)
-        while self.busy:
+        last_edge = None
+        waiting = 0
+        while True:
+            if not self.busy:
+                last_edge = None
+                waiting = 0
+                yield self._cycle_event.wait()
             reply = self._get_reply()
             # valid reply?
             if (bool(reply)):
                 datrd = int(self.bus.datrd)
-                # append reply and meta info to result buffer
-                tmpRes = WBRes(ack=reply,
-                               sel=None,
-                               adr=None,
-                               datrd=datrd,
-                               datwr=None,
-                               waitIdle=None,
-                               waitStall=None,
-                               waitAck=self._clk_cycle_count)
-                self._res_buf.append(tmpRes)
+                now = get_sim_time()
+                # replies come in order of requests
+                if not self._pending:
+                    self.log.error("Reply from slave without a request")
+                    yield clkedge
+                    continue
+                aux = self._pending.popleft()
+                # append reply and meta info to result buffer, wait times
+                # hold simulation time until the cycle is closed
+                self._res_buf.append(aux.result(reply, datrd, now))
                 self._acked_ops += 1
+                waiting = 0
+                self._ack_event.set()
+            elif self._acked_ops < self._driven_ops:
+                waiting += 1
+                if self._timeout is not None and waiting > self._timeout:
+                    self._timed_out = True
+                    self._ack_event.set()
             yield clkedge
-            count += 1
+            if self._clk_period is None:
+                now = get_sim_time()
+                if last_edge is not None:
+                    self._clk_period = now - last_edge
+                last_edge = now
 
     @coroutine
     def _drive(self, we, adr, datwr, sel, idle):
@@ -272,13 +464,21 @@ class WishboneMaster(Wishbone):
             self.bus.sel <= sel
             self.bus.datwr <= datwr
             self.bus.we <= we
+            # queue operation and meta info until the slave replies
+            aux = WBAux(sel, adr, datwr if we else None, 0, idle,
+                        get_sim_time(), we)
+            self._pending.append(aux)
+            self._driven_ops += 1
             yield clkedge
             # deal with flow control (pipelined wishbone)
-            stalled = yield self._wait_stall()
-            # append operation and meta info to auxiliary buffer
-            self._aux_buf.append(
-                WBAux(sel, adr, datwr, stalled, idle, self._clk_cycle_count))
-            # non pipelined wishbone
+            aux.waitStall = yield self._wait_stall()
+            aux.tsAccept = get_sim_time()
+            if self.pipelined:
+                # The request is accepted, strobe stays high only if the
+                # next one is issued right away
+                self.bus.stb <= 0
+                self.bus.we <= 0
+            # non pipelined wishbone, or pipeline window full
             yield self._wait_ack()
             # reset strobe and write enable after the acknowledgement was
             # received. Note that this was different from the original code,
@@ -303,10 +503,10 @@ class WishboneMaster(Wishbone):
         clkedge = RisingEdge(self.clock)
         yield clkedge
         if is_sequence(arg):
+            result = []
             if len(arg) < 1:
                 self.log.error("List contains no operations to carry out")
             else:
-                self._op_cnt = len(arg)
                 firstword = True
                 for op in arg:
                     if not isinstance(op, WBOp):
@@ -316,15 +516,10 @@ class WishboneMaster(Wishbone):
                         )
                     if firstword:
                         firstword = False
-                        result = []
-                        yield self._open_cycle()
-
-                    if op.dat is not None:
-                        we = 1
-                        dat = op.dat
-                    else:
-                        we = 0
-                        dat = 0
+                        yield self._open_cycle(len(arg))
+
+                    we = op.we
+                    dat = op.dat if we else 0
                     yield self._drive(we, op.adr, dat, op.sel, op.idle)
                     self.log.debug(
                         "#%3u WE: %s ADR: 0x%08x DAT: 0x%08x SEL: 0x%1x IDLE:"
@@ -333,16 +528,15 @@ class WishboneMaster(Wishbone):
                     cnt += 1
                 yield self._close_cycle()
 
-                # do pick and mix from result- and auxiliary buffer so we get
-                # all operation and meta info
-                for res, aux in zip(self._res_buf, self._aux_buf):
-                    res.datwr = aux.datwr
-                    res.sel = aux.sel
-                    res.adr = aux.adr
-                    res.waitIdle = aux.waitIdle
-                    res.waitStall = aux.waitStall
-                    res.waitAck -= aux.ts
-                    result.append(res)
+                # results are complete apart from wait times, convert them
+                # now that the clock period is known
+                result = self._res_buf
+                for res in result:
+                    res.waitAck = self._cycles(res.waitAck)
+                    res.latency = self._cycles(res.latency)
+                if self.stats is not None:
+                    self.stats.record(result, self._cycle_start,
+                                      get_sim_time())
 
             raise ReturnValue(result)
         else:
@@ -352,8 +546,45 @@ class WishboneMaster(Wishbone):
             )
             raise ReturnValue(None)
 
+    def post_write(self, adr, data):
+        """Queue a write to be carried out in the background and return
+        immediately. Use ``flush()`` to wait for posted writes to complete.
+
+        Writes posted while the bus is busy are sent together in one cycle.
+        """
+        self._write_queue.append(WBOp(adr >> 2, data))
+        self._writes_done.clear()
+        if self._writer_task is None or self._writer_task._finished:
+            self._writer_task = cocotb.fork(self._drain_writes())
+        else:
+            self._write_posted.set()
+
+    @coroutine
+    def _drain_writes(self):
+        """
+        Driver for posted writes
+        """
+        while True:
+            if not self._write_queue:
+                self._writes_done.set()
+                self._write_posted.clear()
+                yield self._write_posted.wait()
+                continue
+            ops = self._write_queue
+            self._write_queue = []
+            yield self.send_cycle(ops)
+
+    @coroutine
+    def flush(self):
+        """Wait until all posted writes are acknowledged by the slave"""
+        if not self._writes_done.fired:
+            yield self._writes_done.wait()
+
     @coroutine
     def read(self, adr):
+        # Keep the order of accesses, posted writes go first
+        if not self._writes_done.fired:
+            yield self.flush()
         result = yield self.send_cycle([WBOp(adr >> 2)])
         for rec in result:
             self.log.debug("Result: {}".format(rec))
@@ -361,7 +592,24 @@ class WishboneMaster(Wishbone):
 
     @coroutine
     def write(self, adr, data):
+        if not self._writes_done.fired:
+            yield self.flush()
         result = yield self.send_cycle([WBOp(adr >> 2, data)])
         for rec in result:
             self.log.debug("Result: {}".format(rec))
         raise ReturnValue(0)
+
+    @coroutine
+    def write_burst(self, adr, data):
+        """Write all values from *data* to a single address (i.e. a FIFO)
+        within one bus cycle.
+        """
+        ops = [WBOp(adr >> 2, d) for d in data]
+        if not ops:
+            raise ReturnValue(0)
+        if not self._writes_done.fired:
+            yield self.flush()
+        result = yield self.send_cycle(ops)
+        for rec in result:
+            self.log.debug("Result: {}".format(rec))
+        raise ReturnValue(0)
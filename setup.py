@@ -19,4 +19,6 @@ setuptools.setup(
         "Operating System :: OS Independent",
          ],
     python_requires='>=3.6',
+    # deadline.py reads scheduler state of cocotb 1.3 when aborting
+    install_requires=['cocotb>=1.3,<1.4'],
 )